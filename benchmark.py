@@ -0,0 +1,417 @@
+"""
+Benchmarks for Directory Tree Generator
+Builds synthetic trees and times generate_tree for each output format and scan mode
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Version of the results file layout
+RESULTS_VERSION = 1
+SHAPES = ("wide", "deep", "mixed")
+# Keyword arguments of dir_tree.TreeOptions for each scan mode; index runs
+# are timed against an index that was filled by one untimed run
+MODES = {
+    "serial": {},
+    "workers": {"workers": 8},
+    "processes": {"processes": min(4, os.cpu_count() or 1)},
+    "sizes": {"sizes": True, "top": 20},
+    "index": {},
+}
+# Files per directory of the wide shape
+WIDE_DIRECTORY_SIZE = 1000
+# Average files per directory of the mixed shape
+MIXED_DIRECTORY_SIZE = 20
+# Directory times are set to this, so the scan index trusts fresh trees
+FIXED_MTIME = datetime(2020, 1, 1).timestamp()
+# Median time increase reported as a regression by compare
+DEFAULT_THRESHOLD = 0.10
+# Modules a headless CLI run must not import
+HEADLESS_EXCLUDED = ("tkinter", "updater", "requests", "multiprocessing", "concurrent.futures", "sqlite3")
+# Milliseconds a headless CLI run may spend importing modules, as reported
+# by -X importtime, beyond what the bare interpreter imports. A Linux VM
+# measures 47 ms, against 84 ms while tkinter, multiprocessing and the
+# updater were imported up front.
+STARTUP_TARGET_MS = 60
+
+
+def make_tree(root, shape, files, depth=200, seed=0):
+    """Create a synthetic tree of about files files under root and return (directories, files)
+
+    wide has flat directories of WIDE_DIRECTORY_SIZE files, deep is a
+    chain of depth nested directories with the files spread along it, and
+    mixed has random branching up to depth levels (12 at most), names of
+    varying length and some non-ASCII names. The same arguments always
+    give the same tree.
+    """
+    rng = random.Random(seed)
+    directories = [root]
+    if shape == "wide":
+        for number in range(max(files // WIDE_DIRECTORY_SIZE, 1)):
+            directories.append(os.path.join(root, f"dir{number:05d}"))
+    elif shape == "deep":
+        path = root
+        for level in range(depth):
+            path = os.path.join(path, f"d{level:03d}")
+            directories.append(path)
+    elif shape == "mixed":
+        max_depth = min(depth, 12)
+        wanted = max(files // MIXED_DIRECTORY_SIZE, 1)
+        # Breadth first, so every level up to max_depth gets directories
+        pending = [(root, 0)]
+        while pending and len(directories) < wanted:
+            parent, level = pending.pop(0)
+            if level >= max_depth:
+                continue
+            for number in range(rng.randint(1, 8)):
+                path = os.path.join(parent, _random_name(rng, number))
+                directories.append(path)
+                pending.append((path, level + 1))
+    else:
+        raise ValueError(f"Unknown shape '{shape}', choose from {', '.join(SHAPES)}")
+
+    for path in directories:
+        os.makedirs(path, exist_ok=True)
+    flags = os.O_CREAT | os.O_WRONLY | getattr(os, "O_BINARY", 0)
+    for number in range(files):
+        if shape == "mixed":
+            directory = directories[rng.randrange(len(directories))]
+            name = _random_name(rng, number) + rng.choice((".txt", ".py", ".json", ".log", ""))
+        else:
+            directory = directories[1 + number % (len(directories) - 1)] if len(directories) > 1 else root
+            name = f"file{number:07d}.txt"
+        os.close(os.open(os.path.join(directory, name), flags, 0o644))
+    # Deepest first, since creating an entry changes its parent's mtime
+    for path in reversed(directories):
+        os.utime(path, (FIXED_MTIME, FIXED_MTIME))
+    return len(directories), files
+
+
+def _random_name(rng, number):
+    # Unique by number; lengths vary and about 1 in 20 names is not ASCII
+    stem = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz_-") for _ in range(rng.randint(1, 24)))
+    if rng.random() < 0.05:
+        stem = rng.choice(("données", "файл", "文件", "ファイル")) + "_" + stem
+    return f"{stem}_{number}"
+
+
+def peak_rss():
+    """Return the peak resident memory of this process and of its finished children in bytes"""
+    if resource is None:
+        return None, None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+def run_case(tree, format, mode, repeat, output_dir):
+    """Time generate_tree on tree and return the result; meant to run in its own process
+
+    The first run warms the filesystem cache (and fills the index in index
+    mode) and is not counted.
+    """
+    import dir_tree
+    import progress
+    import scan_index
+
+    options = dir_tree.TreeOptions(format, **MODES[mode])
+    index = None
+    if mode == "index":
+        index = scan_index.ScanIndex(os.path.join(output_dir, "index.db"))
+    output_file = os.path.join(output_dir, "tree." + _extension(format))
+
+    seconds = []
+    stats = None
+    try:
+        for run in range(repeat + 1):
+            stats = progress.RunStats(io.StringIO())
+            start = time.perf_counter()
+            if not dir_tree.generate_tree(tree, output_file, options, index, stats=stats):
+                raise RuntimeError(f"generate_tree failed for {format} in {mode} mode")
+            if run:
+                seconds.append(time.perf_counter() - start)
+    finally:
+        if index is not None:
+            index.close()
+
+    entries = stats.directories + stats.files
+    rss, child_rss = peak_rss()
+    median = statistics.median(seconds)
+    return {
+        "format": format,
+        "mode": mode,
+        "entries": entries,
+        "seconds": seconds,
+        "best": min(seconds),
+        "median": median,
+        "entries_per_second": entries / median if median else None,
+        "output_bytes": os.path.getsize(output_file),
+        "walk": stats.walk_time,
+        "render": stats.render_time,
+        "write": stats.write_time,
+        "peak_rss": rss,
+        "peak_child_rss": child_rss,
+    }
+
+
+def _extension(format):
+    import renderers
+    return renderers.get_renderer(format).extension
+
+
+def run(shapes, formats, modes, files, depth, repeat, tree_dir=None, seed=0):
+    """Build the trees and time every format and mode on them, each case in a fresh process"""
+    results = {
+        "version": RESULTS_VERSION,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "parameters": {"files": files, "depth": depth, "repeat": repeat, "seed": seed},
+        "trees": {},
+        "results": [],
+    }
+    base_dir = tree_dir or tempfile.mkdtemp(prefix="dir_tree_bench_")
+    try:
+        for shape in shapes:
+            tree = os.path.join(base_dir, f"{shape}_{files}_{depth}_{seed}")
+            if not os.path.isdir(tree):
+                start = time.perf_counter()
+                directories, count = make_tree(tree + ".part", shape, files, depth, seed)
+                os.replace(tree + ".part", tree)
+                print(f"Built {shape} tree: {directories:,} directories, {count:,} files "
+                      f"in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+            results["trees"][shape] = tree
+
+            for format in formats:
+                for mode in modes:
+                    result = _run_case_process(tree, format, mode, repeat)
+                    result["shape"] = shape
+                    results["results"].append(result)
+                    print(_format_result(result), file=sys.stderr)
+    finally:
+        if tree_dir is None:
+            shutil.rmtree(base_dir, ignore_errors=True)
+    return results
+
+
+def _run_case_process(tree, format, mode, repeat):
+    # A process per case, so peak RSS and caches are not carried over
+    with tempfile.TemporaryDirectory(prefix="dir_tree_bench_out_") as output_dir:
+        case = json.dumps({"tree": tree, "format": format, "mode": mode, "repeat": repeat,
+                           "output_dir": output_dir})
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), "case", case],
+                                   stdout=subprocess.PIPE, check=True,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        return json.loads(completed.stdout)
+
+
+def _format_result(result):
+    rss = f"{result['peak_rss'] / 2**20:.0f} MiB" if result["peak_rss"] else "n/a"
+    return (f"{result['shape']:6} {result['format']:10} {result['mode']:10} "
+            f"{result['median']:8.3f} s {result['entries_per_second']:>12,.0f} entries/s  peak RSS {rss}")
+
+
+def startup(runs=10):
+    """Measure the cold start of a headless run on a tiny tree
+
+    Returns the wall times in milliseconds (best of runs) of the bare
+    interpreter and of the run, the import time of the modules the run
+    imports beyond the interpreter's own (best of runs), the slowest of
+    those imports and any of HEADLESS_EXCLUDED that were imported.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory(prefix="dir_tree_startup_") as temp_dir:
+        tree = os.path.join(temp_dir, "tree")
+        make_tree(tree, "wide", 10)
+        arguments = [os.path.join(here, "dir_tree.py"), tree, "-o", os.path.join(temp_dir, "tree.txt"),
+                     "--no-gui"]
+
+        interpreter = min(_timed_run([sys.executable, "-c", "pass"]) for _ in range(runs))
+        wall = min(_timed_run([sys.executable] + arguments) for _ in range(runs))
+        preloaded = {name for name, depth, ms in _import_times(["-c", "pass"])}
+        best = None
+        for _ in range(runs):
+            imports = _import_times(arguments)
+            added = [(ms, name) for name, depth, ms in imports if depth == 0 and name not in preloaded]
+            if best is None or sum(ms for ms, _ in added) < sum(ms for ms, _ in best):
+                best = added
+                modules = [name for name, depth, ms in imports]
+
+    return {
+        "interpreter_ms": interpreter * 1000,
+        "wall_ms": wall * 1000,
+        "import_ms": sum(ms for ms, _ in best),
+        "slowest_imports": sorted(best, reverse=True)[:10],
+        "excluded_imports": sorted({name for name in modules for module in HEADLESS_EXCLUDED
+                                    if name == module or name.startswith(module + ".")}),
+    }
+
+
+def _timed_run(command):
+    start = time.perf_counter()
+    subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def _import_times(arguments):
+    # Returns (module, nesting depth, cumulative ms) of every module a run
+    # imports, as reported by -X importtime
+    completed = subprocess.run([sys.executable, "-X", "importtime"] + arguments, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    imports = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented by two spaces per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), depth, int(cumulative) / 1000))
+    return imports
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Return (lines, regressions) comparing the median times of two results files
+
+    Cases are matched by shape, format and mode; a regression is a median
+    time more than threshold slower than the baseline.
+    """
+    def cases(results):
+        return {(r["shape"], r["format"], r["mode"]): r for r in results["results"]}
+
+    before, after = cases(baseline), cases(current)
+    def tree_parameters(results):
+        parameters = results.get("parameters", {})
+        return {name: parameters.get(name) for name in ("files", "depth", "seed")}
+
+    lines = []
+    if tree_parameters(baseline) != tree_parameters(current):
+        lines.append(f"Warning: the runs used different trees: "
+                     f"{tree_parameters(baseline)} and {tree_parameters(current)}")
+    lines.append(f"{'shape':6} {'format':10} {'mode':10} {'before':>9} {'after':>9} {'change':>8}")
+    regressions = []
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key]["median"], after[key]["median"]
+        change = new / old - 1 if old else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(key)
+            flag = "  REGRESSION"
+        lines.append(f"{key[0]:6} {key[1]:10} {key[2]:10} {old:8.3f}s {new:8.3f}s {change:+8.1%}{flag}")
+    for key in sorted(before.keys() ^ after.keys()):
+        lines.append(f"{key[0]:6} {key[1]:10} {key[2]:10} only in {'baseline' if key in before else 'current'}")
+    return lines, regressions
+
+
+def main():
+    import renderers
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark directory tree generation on synthetic trees",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python benchmark.py run -o before.json                      # All shapes, formats and modes
+  python benchmark.py run --files 1000000 --shapes wide -o 1m.json
+  python benchmark.py run --shapes deep --depth 200 --formats text --modes serial
+  python benchmark.py compare before.json after.json          # Exit status 1 on regressions
+  python benchmark.py startup                                 # Exit status 1 over the import budget
+        """
+    )
+    commands = parser.add_subparsers(dest="command")
+
+    run_parser = commands.add_parser("run", help="Build trees and time generation")
+    run_parser.add_argument("--shapes", nargs="+", choices=SHAPES, default=list(SHAPES))
+    run_parser.add_argument("--formats", nargs="+", choices=renderers.renderer_names(),
+                            default=renderers.renderer_names())
+    run_parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    run_parser.add_argument("--files", type=int, default=100000, help="Files per tree (default: 100000)")
+    run_parser.add_argument("--depth", type=int, default=200,
+                            help="Depth of the deep tree, and the mixed tree up to 12 (default: 200)")
+    run_parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case (default: 3)")
+    run_parser.add_argument("--seed", type=int, default=0, help="Seed of the mixed tree (default: 0)")
+    run_parser.add_argument("--tree-dir", metavar="DIR",
+                            help="Keep the trees in DIR and reuse them in later runs")
+    run_parser.add_argument("-o", "--output", help="Write the results to this JSON file")
+
+    compare_parser = commands.add_parser("compare", help="Compare two results files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                help=f"Slowdown reported as a regression (default: {DEFAULT_THRESHOLD})")
+
+    startup_parser = commands.add_parser("startup", help="Measure the cold start of a headless run")
+    startup_parser.add_argument("--runs", type=int, default=10, help="Runs to take the best of (default: 10)")
+    startup_parser.add_argument("--target-ms", type=float, default=STARTUP_TARGET_MS,
+                                help=f"Import time budget in milliseconds (default: {STARTUP_TARGET_MS})")
+    startup_parser.add_argument("-o", "--output", help="Write the measurements to this JSON file")
+
+    # Runs one case for run(), not meant to be called directly
+    case_parser = commands.add_parser("case")
+    case_parser.add_argument("case")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        if args.files < 1 or args.repeat < 1 or args.depth < 1:
+            print("Error: --files, --depth and --repeat must be at least 1")
+            sys.exit(1)
+        results = run(args.shapes, args.formats, args.modes, args.files, args.depth, args.repeat,
+                      args.tree_dir, args.seed)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {args.output}")
+    elif args.command == "compare":
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.current, encoding='utf-8') as f:
+            current = json.load(f)
+        lines, regressions = compare(baseline, current, args.threshold)
+        print("\n".join(lines))
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+            sys.exit(1)
+    elif args.command == "startup":
+        result = startup(max(args.runs, 1))
+        result["target_ms"] = args.target_ms
+        print(f"Interpreter:   {result['interpreter_ms']:6.1f} ms")
+        print(f"Headless run:  {result['wall_ms']:6.1f} ms")
+        print(f"Imports:       {result['import_ms']:6.1f} ms (target {args.target_ms:g} ms)")
+        for ms, name in result["slowest_imports"]:
+            print(f"  {ms:6.1f} ms  {name}")
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(result, f, indent=2)
+        if result["excluded_imports"]:
+            print(f"Error: the headless run imported {', '.join(result['excluded_imports'])}")
+            sys.exit(1)
+        if result["import_ms"] > args.target_ms:
+            print("Error: imports are over the target")
+            sys.exit(1)
+    elif args.command == "case":
+        case = json.loads(args.case)
+        json.dump(run_case(case["tree"], case["format"], case["mode"], case["repeat"], case["output_dir"]),
+                  sys.stdout)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
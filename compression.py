@@ -0,0 +1,95 @@
+"""
+Compressed output for Directory Tree Generator
+Picks a compressor from the output file extension and streams text through it
+"""
+
+import io
+
+# extension: (name, lowest level, highest level, default level)
+FORMATS = {
+    ".gz": ("gzip", 1, 9, 6),
+    ".bz2": ("bzip2", 1, 9, 9),
+    ".xz": ("xz", 0, 9, 6),
+    ".zst": ("zstd", 1, 22, 3),
+}
+
+
+def detect(path):
+    """Return the compressed extension of path, or None for plain output"""
+    for extension in FORMATS:
+        if path.lower().endswith(extension):
+            return extension
+    return None
+
+
+def open_text(path, level=None, buffering=-1, wrap_raw=None):
+    """Open path for writing UTF-8 text, compressed if its extension asks for it
+
+    Text is encoded and compressed as it is written, in chunks, so memory
+    does not depend on the size of the output. level defaults to the
+    usual level of each compressor; ValueError is raised for levels out
+    of range and for .zst files when zstandard is not installed.
+    wrap_raw(raw), if given, returns the raw stream to buffer instead of raw,
+    e.g. to measure the bytes that reach the file.
+    """
+    extension = detect(path)
+    if extension is None:
+        if wrap_raw is None:
+            return open(path, 'w', encoding='utf-8', buffering=buffering)
+        return text_writer(wrap_raw(io.FileIO(path, 'w')), buffering)
+
+    name, lowest, highest, default = FORMATS[extension]
+    if level is None:
+        level = default
+    elif not lowest <= level <= highest:
+        raise ValueError(f"{name} compression level must be between {lowest} and {highest}")
+
+    # Compressors are imported on first use, plain output does not need them
+    if extension == ".gz":
+        import gzip
+        stream = gzip.open(path, 'wb', compresslevel=level)
+    elif extension == ".bz2":
+        import bz2
+        stream = bz2.open(path, 'wb', compresslevel=level)
+    elif extension == ".xz":
+        import lzma
+        stream = lzma.open(path, 'wb', preset=level)
+    else:
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("Writing .zst files needs the zstandard package (pip install zstandard)") from None
+        stream = zstandard.ZstdCompressor(level=level).stream_writer(open(path, 'wb'), closefd=True)
+    raw = _Raw(stream, path)
+    if wrap_raw is not None:
+        raw = wrap_raw(raw)
+    # The buffered writer hands the compressor large blocks instead of
+    # every small write
+    return text_writer(raw, buffering)
+
+
+def text_writer(raw, buffering=-1):
+    """Wrap a raw binary stream for writing UTF-8 text, like open() does"""
+    if buffering <= 0:
+        buffering = io.DEFAULT_BUFFER_SIZE
+    return io.TextIOWrapper(io.BufferedWriter(raw, buffer_size=buffering), encoding='utf-8')
+
+
+class _Raw(io.RawIOBase):
+    """Lets io.BufferedWriter write to a compressor stream"""
+
+    def __init__(self, stream, name):
+        self._stream = stream
+        self.name = name
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._stream.write(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._stream.close()
+        super().close()
@@ -1,10 +1,22 @@
+import io
 import os
 import sys
 import platform
-import tkinter as tk
-from tkinter import filedialog, messagebox
+import time
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
 
+# Only what generating a tree needs is imported here; tkinter, the updater
+# (and requests), multiprocessing and the scan index are imported on first
+# use, so headless runs start quickly
+import compression
+import disk_usage
+import progress
+import renderers
+import walker
+from tree_filter import TreeFilter
+from tree_options import TreeOptions
+
 # Platform detection
 CURRENT_OS = platform.system().lower()
 
@@ -19,49 +31,397 @@ elif CURRENT_OS == "linux":
 elif CURRENT_OS == "darwin":  # macOS
     pass  # No special imports needed for macOS
 
-# Try to import updater
-try:
-    from updater import check_for_updates_gui
-    UPDATER_AVAILABLE = True
-except ImportError:
-    UPDATER_AVAILABLE = False
+# Size of the write buffer used when streaming the tree to disk
+WRITE_BUFFER_SIZE = 1024 * 1024
+# Size of the write buffer used when streaming the tree to stdout
+STDOUT_BUFFER_SIZE = 64 * 1024
+# Seconds between progress updates and between polls in the GUI
+PROGRESS_INTERVAL = 0.1
+
+class GenerationCancelled(Exception):
+    """Raised inside generate_tree when its cancel event is set"""
 
-def generate_tree(start_path, output_file, format="text"):
+def generate_tree(start_path, output_file, options=None, index=None, progress=None, cancel=None, stats=None,
+                  thread_pool=None, process_pool=None, snapshot_file=None):
+    # options (a TreeOptions, defaults without one) says how the tree is
+    # scanned and rendered. progress(entries, path) is called for every
+    # directory walked, with the number of entries so far; setting the
+    # cancel event (a threading.Event) stops the walk at the next directory
+    # and removes the partial output. stats (a progress.RunStats) counts and
+    # times the run and reports it. thread_pool and process_pool replace the
+    # pools of options.workers threads and options.processes processes, so
+    # several runs can share them. With snapshot_file, the walked tree is
+    # also saved as a snapshot (not sharded then).
+    options = options or TreeOptions()
+    finished = False
     try:
-        tree = []
-        for root, dirs, files in os.walk(start_path):
-            level = root.replace(start_path, '').count(os.sep)
-            indent = '    |' * (level)
-            if format == "markdown":
-                tree.append(f"{indent}- {os.path.basename(root)}/")
-            elif format == "html":
-                tree.append(f"<div style='margin-left: {level * 20}px;'>{os.path.basename(root)}/</div>")
-            else:
-                tree.append(f"{indent}__{os.path.basename(root)}/")
-            
-            sub_indent = '    |' * (level + 1)
-            for file in files:
-                if format == "markdown":
-                    tree.append(f"{sub_indent}- {file}")
-                elif format == "html":
-                    tree.append(f"<div style='margin-left: {(level + 1) * 20}px;'>- {file}</div>")
-                else:
-                    tree.append(f"{sub_indent}__{file}")
-        
-        with open(output_file, 'w', encoding='utf-8') as f:
-            if format == "html":
-                f.write("<html><body>\n")
-                f.write("\n".join(tree))
-                f.write("\n</body></html>")
+        renderer = options.renderer()
+        scan = walker.scan_directory
+        if index is not None:
+            index.touch_root(start_path)
+            scan = index.scan
+
+        largest = disk_usage.LargestEntries(options.top) if options.top else None
+        totals = disk_usage.DirectoryTotals(largest, options.count_hardlinks_once)
+        # The output file (and html-lazy's data folder) exists before the
+        # walk reaches it, it must not list itself when written inside the tree
+        ignore = renderer.output_paths(output_file) if output_file != "-" else ()
+        with _open_tree_file(output_file, renderer, options.compress_level, stats) as f:
+            model = None
+            if options.processes > 1 and renderer.shardable and snapshot_file is None:
+                _write_sharded_tree(f, start_path, renderer, options, totals, index, progress, cancel,
+                                    stats, process_pool, ignore)
             else:
-                f.write("\n".join(tree))
+                entries = walker.walk(start_path, options.follow_symlinks, workers=options.workers, scan=scan,
+                                      tree_filter=options.tree_filter, pool=thread_pool, ignore=ignore)
+                if stats is not None:
+                    entries = stats.walk(entries)
+                if snapshot_file is not None:
+                    import tree_model
+                    model = tree_model.TreeModel(options.measure)
+                    entries = model.record(entries, options.follow_symlinks)
+                if progress is not None or cancel is not None:
+                    entries = _monitored(entries, progress, cancel)
+                _write_tree(f, entries, renderer, totals, options.measure)
+                _finish_totals(f, renderer, totals)
+            if largest is not None:
+                renderer.summary(f, largest.count, largest.files(), largest.directories())
+        if model is not None:
+            import snapshot
+            snapshot.save(model, snapshot_file)
         
+        finished = True
+        return True
+    except BrokenPipeError:
+        # The reader of stdout went away, the caller decides how to exit
+        raise
+    except GenerationCancelled:
+        if output_file != "-" and os.path.exists(output_file):
+            os.remove(output_file)
+        return False
+    except Exception as e:
+        print(f"Error: {e}", file=_status_stream(output_file))
+        return False
+    finally:
+        if stats is not None:
+            stats.finish(summary=finished)
+
+def write_tree(entries, output_file, options=None):
+    """Render (path, depth, dirs, files) entries, as produced by walker.walk, to a file
+
+    output_file may also be an open text stream, which is left open. Only
+    the render options of options (a TreeOptions) apply.
+    """
+    options = options or TreeOptions()
+    try:
+        renderer = options.renderer()
+        largest = disk_usage.LargestEntries(options.top) if options.top else None
+        totals = disk_usage.DirectoryTotals(largest)
+        with _open_tree_file(output_file, renderer, options.compress_level) as f:
+            _write_tree(f, entries, renderer, totals, options.measure)
+            _finish_totals(f, renderer, totals)
+            if largest is not None:
+                renderer.summary(f, largest.count, largest.files(), largest.directories())
         return True
+    except BrokenPipeError:
+        raise
     except Exception as e:
-        print(f"Error: {e}")
+        print(f"Error: {e}", file=_status_stream(output_file))
         return False
 
+def render_snapshot(snapshot_file, output_file, options=None):
+    """Render a tree saved with --save-snapshot, without scanning the directory again"""
+    import snapshot
+    options = options or TreeOptions()
+    try:
+        model = snapshot.load(snapshot_file)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=_status_stream(output_file))
+        return False
+    if options.measure and not model.sizes:
+        print("Error: the snapshot has no sizes, save it with --sizes or --top",
+              file=_status_stream(output_file))
+        return False
+    return write_tree(model.entries(), output_file, options)
+
+def generate_trees(jobs, options=None, stats_stream=None, index=None, snapshot_file=None):
+    """Generate the tree of each (start_path, output_file) job in turn
+
+    Yields (start_path, output_file, success, stats) as each tree is done.
+    All trees share the options (a TreeOptions), the scan index, one pool
+    of options.workers listing threads and one pool of options.processes
+    shard processes. With stats_stream, every tree gets a
+    progress.RunStats reporting to it, otherwise stats is None.
+    """
+    options = options or TreeOptions()
+    thread_pool = process_pool = None
+    if options.workers > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        thread_pool = ThreadPoolExecutor(max_workers=options.workers)
+    if options.processes > 1 and options.renderer().shardable:
+        from concurrent.futures import ProcessPoolExecutor
+        process_pool = ProcessPoolExecutor(max_workers=options.processes)
+    try:
+        for start_path, output_file in jobs:
+            stats = progress.RunStats(stats_stream) if stats_stream is not None else None
+            success = generate_tree(start_path, output_file, options, index, stats=stats, thread_pool=thread_pool,
+                                    process_pool=process_pool, snapshot_file=snapshot_file)
+            yield start_path, output_file, success, stats
+    finally:
+        if thread_pool is not None:
+            thread_pool.shutdown()
+        if process_pool is not None:
+            process_pool.shutdown()
+
+def read_manifest(path):
+    """Return the directories listed in a file, or in stdin for "-"
+
+    One directory per line; blank lines and lines starting with # are skipped.
+    """
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    return [line.strip() for line in lines if line.strip() and not line.strip().startswith("#")]
+
+def watch_tree(start_path, output_file, options=None, debounce=1.0):
+    """Write the tree, then keep rewriting it as the directory changes (Linux only)
+
+    Only the render options of options (a TreeOptions) apply. With sizes
+    or top, file sizes are read again on every rewrite; a rewrite follows
+    entries being added, removed or renamed, not files growing.
+    """
+    import watcher
+
+    options = options or TreeOptions()
+    # Keeps the compression extension, so the temporary file is compressed too
+    temp_file = output_file + ".tmp" + (compression.detect(output_file) or "")
+
+    def rewrite(tree):
+        # Replaced atomically so readers never see a half-written file
+        if write_tree(tree.entries(), temp_file, options):
+            os.replace(temp_file, output_file)
+
+    renderer = options.renderer()
+    tree = watcher.TreeWatcher(start_path,
+                               ignore=renderer.output_paths(output_file) + renderer.output_paths(temp_file))
+    try:
+        tree.scan()
+        rewrite(tree)
+        print(f"Directory tree generated successfully: {output_file}")
+        print(tree.memory_report())
+        print("Watching for changes, press Ctrl+C to stop")
+        tree.run(rewrite, debounce)
+    finally:
+        tree.close()
+
+def _monitored(entries, progress=None, cancel=None, scanned=0):
+    # Passes walk entries through, reporting progress and checking for
+    # cancellation before each directory
+    for entry in entries:
+        if cancel is not None and cancel.is_set():
+            raise GenerationCancelled("Cancelled")
+        scanned += 1 + len(entry[3])
+        if progress is not None:
+            progress(scanned, entry[0])
+        yield entry
+
+def _output_path(directory, extension, timestamp, output_dir=None, taken=()):
+    # <name>_tree_<timestamp>.<extension> in the directory itself or in
+    # output_dir, numbered if another directory of the batch has the same name
+    base_name = os.path.basename(os.path.normpath(directory))
+    folder = output_dir or directory
+    output_file = os.path.join(folder, f"{base_name}_tree_{timestamp}.{extension}")
+    number = 2
+    while output_file in taken:
+        output_file = os.path.join(folder, f"{base_name}_tree_{timestamp}_{number}.{extension}")
+        number += 1
+    return output_file
+
+def _close_broken_stdout():
+    # After stdout was closed by its reader, e.g. when piped into head;
+    # stdout is pointed at devnull so the interpreter's final flush does
+    # not fail again
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+
+def _status_stream(output_file):
+    # Messages must not end up in the tree when it is written to stdout
+    return sys.stderr if output_file == "-" else sys.stdout
+
+@contextmanager
+def _open_tree_file(output_file, renderer, compress_level=None, stats=None):
+    # Opens the output, compressed if its extension asks for it, or stdout
+    # for "-", and has the renderer write the document header and footer.
+    # With stats, writes to the file (or compressor) are timed and counted.
+    # An open text stream is written to as it is and only flushed.
+    wrap_raw = stats.wrap_raw if stats is not None else None
+    if not isinstance(output_file, str):
+        f = nullcontext(output_file)
+    elif output_file == "-":
+        sys.stdout.flush()
+        # A smaller buffer, so a closed pipe is noticed soon and stops the walk
+        if wrap_raw is None:
+            f = open(sys.stdout.fileno(), 'w', encoding='utf-8', buffering=STDOUT_BUFFER_SIZE, closefd=False)
+        else:
+            raw = wrap_raw(io.FileIO(sys.stdout.fileno(), 'w', closefd=False))
+            f = compression.text_writer(raw, STDOUT_BUFFER_SIZE)
+    else:
+        f = compression.open_text(output_file, compress_level, WRITE_BUFFER_SIZE, wrap_raw)
+    with f as stream:
+        renderer.begin(stream)
+        yield stream
+        renderer.end(stream)
+        stream.flush()
+
+def _write_tree(f, entries, renderer, totals, measure=False):
+    # Entries are rendered as soon as they are walked; totals only keeps the
+    # chain of open directories, so memory stays flat however large the
+    # tree is. A directory is closed once the walk has left it, and with
+    # measure its files' sizes are collected and rolled up.
+    for root, level, dirs, files in entries:
+        _close_directories(f, renderer, totals.enter(root, level))
+        renderer.directory(f, root, level)
+        if not measure:
+            renderer.files(f, files, level)
+            continue
+        for entry in files:
+            apparent, allocated = disk_usage.file_usage(entry)
+            counted = totals.add_file(entry, apparent, allocated)
+            usage = (apparent, allocated) if renderer.sizes else None
+            renderer.file(f, entry, level, usage, counted)
+
+def _finish_totals(f, renderer, totals):
+    # Closes every directory still open once the walk is over
+    closed = totals.leave()
+    _close_directories(f, renderer, closed)
+    return closed
+
+def _close_directories(f, renderer, closed):
+    for path, level, apparent, allocated in closed:
+        renderer.close_directory(f, path, level, (apparent, allocated) if renderer.sizes else None)
+
+def _write_sharded_tree(f, start_path, renderer, options, totals, index=None, progress=None, cancel=None,
+                        stats=None, process_pool=None, ignore=()):
+    # The start directory is rendered here; each top-level subdirectory is
+    # rendered by a worker process into a fragment file, and the fragments
+    # are appended in walk order so the result matches a serial run.
+    # Workers open their own connection to the scan index, if any, and get
+    # a copy of options whose filter already holds the start directory's rules.
+    # Shard size totals and largest entries are sent back and merged.
+    # When following symlinks, every shard starts from the identities of the
+    # start directory and all shard roots, so loops back into them are cut;
+    # below that each shard keeps its own visited set, as do hardlink counts.
+    # Progress is reported and cancellation checked as each shard is merged;
+    # stats counts the time spent waiting for shards as walk time.
+    # The paths in ignore are left out here and in the shards.
+    index_path = None
+    scan = walker.scan_directory
+    if index is not None:
+        index_path = index.path
+        scan = index.scan
+
+    # Only the start directory is taken from this walk
+    root_walk = walker.walk(start_path, options.follow_symlinks, scan=scan, tree_filter=options.tree_filter,
+                            ignore=ignore)
+    root = next(root_walk, None)
+    root_walk.close()
+    if root is None:
+        return
+    if stats is not None:
+        stats.add_shard(1, len(root[3]), 0.0)
+    _write_tree(f, [root], renderer, totals, options.measure)
+
+    visited = None
+    subdirectories = walker.subdirectories(root[2], options.follow_symlinks)
+    if options.follow_symlinks:
+        visited = set()
+        walker.first_visit(visited, start_path)
+        subdirectories = [entry for entry in subdirectories if walker.first_visit(visited, entry.path)]
+
+    import shutil
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+
+    if process_pool is not None:
+        # Shared with other runs, it stays open
+        pool_context = nullcontext(process_pool)
+    else:
+        pool_context = ProcessPoolExecutor(max_workers=options.processes)
+
+    with tempfile.TemporaryDirectory(prefix="dir_tree_") as fragment_dir:
+        with pool_context as pool:
+            shards = []
+            for number, entry in enumerate(subdirectories):
+                fragment_file = os.path.join(fragment_dir, f"shard_{number}.part")
+                # Tells the shard whether its first line follows a sibling
+                after_sibling = number > 0 or bool(root[3])
+                shards.append((fragment_file, pool.submit(
+                    _render_shard, entry.path, fragment_file, options, index_path, visited, after_sibling,
+                    ignore)))
+
+            try:
+                scanned = 1 + len(root[3])
+                for (fragment_file, shard), entry in zip(shards, subdirectories):
+                    if cancel is not None and cancel.is_set():
+                        raise GenerationCancelled("Cancelled")
+                    waited = time.perf_counter()
+                    usage, largest, (directories, files) = shard.result()
+                    scanned += directories + files
+                    if stats is not None:
+                        stats.add_shard(directories, files, time.perf_counter() - waited)
+                    if progress is not None:
+                        progress(scanned, entry.path)
+                    with open(fragment_file, 'r', encoding='utf-8', newline='') as fragment:
+                        shutil.copyfileobj(fragment, f, WRITE_BUFFER_SIZE)
+                    totals.add(*usage)
+                    if largest is not None:
+                        totals.largest.merge(largest)
+            except BaseException:
+                # Shards that have not started are not waited for, e.g.
+                # once the reader of stdout went away
+                for fragment_file, shard in shards:
+                    shard.cancel()
+                raise
+
+    _finish_totals(f, renderer, totals)
+
+def _render_shard(path, fragment_file, options, index_path=None, visited=None, after_sibling=True, ignore=()):
+    # Runs in a worker process; the subtree sits one level below the start
+    # directory and the renderer continues the parent's output, so
+    # fragments can be concatenated as they are. Returns the subtree's
+    # size totals, its largest entries and its numbers of directories and files.
+    import scan_index
+
+    index = scan_index.ScanIndex(index_path) if index_path else None
+    scan = index.scan if index is not None else walker.scan_directory
+    renderer = options.renderer()
+    renderer.resume(after_sibling)
+    largest = disk_usage.LargestEntries(options.top) if options.top else None
+    totals = disk_usage.DirectoryTotals(largest, options.count_hardlinks_once)
+    try:
+        with open(fragment_file, 'w', encoding='utf-8', newline='', buffering=WRITE_BUFFER_SIZE) as f:
+            entries = walker.walk(path, options.follow_symlinks, workers=options.workers, depth=1, scan=scan,
+                                  tree_filter=options.tree_filter, visited=visited, ignore=ignore)
+            # Directories and files walked
+            counts = [0, 0]
+
+            def count(entries, path):
+                counts[0] += 1
+                counts[1] = entries - counts[0]
+
+            _write_tree(f, _monitored(entries, count), renderer, totals, options.measure)
+            closed = _finish_totals(f, renderer, totals)
+            # The outermost completed directory is the shard itself
+            return (closed[-1][2:] if closed else (0, 0)), largest, tuple(counts)
+    finally:
+        if index is not None:
+            index.close()
+
 def add_context_menu_windows():
+    from tkinter import messagebox
+
     if winreg is None:
         messagebox.showerror("Error", "winreg module not available")
         return
@@ -83,6 +443,8 @@ def add_context_menu_windows():
         messagebox.showerror("Error", f"Failed to add context menu entry: {e}")
 
 def remove_context_menu_windows():
+    from tkinter import messagebox
+
     if winreg is None:
         messagebox.showerror("Error", "winreg module not available")
         return
@@ -96,6 +458,8 @@ def remove_context_menu_windows():
         messagebox.showerror("Error", f"Failed to remove context menu entry: {e}")
 
 def add_context_menu_linux():
+    from tkinter import messagebox
+
     # Create .desktop file for Nautilus/GNOME context menu integration
     desktop_file_content = f"""[Desktop Entry]
 Version=1.0
@@ -126,6 +490,8 @@ MimeType=inode/directory;
         messagebox.showerror("Error", f"Failed to create .desktop file: {e}")
 
 def remove_context_menu_linux():
+    from tkinter import messagebox
+
     desktop_file_path = os.path.expanduser("~/.local/share/applications/generate-directory-tree.desktop")
     
     try:
@@ -138,6 +504,8 @@ def remove_context_menu_linux():
         messagebox.showerror("Error", f"Failed to remove .desktop file: {e}")
 
 def add_context_menu_macos():
+    from tkinter import messagebox
+
     # Create plist file for Finder context menu integration
     plist_content = f"""<?xml version="1.0" encoding="UTF-8"?>
 <!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
@@ -191,6 +559,8 @@ def add_context_menu_macos():
         messagebox.showerror("Error", f"Failed to create service: {e}")
 
 def remove_context_menu_macos():
+    from tkinter import messagebox
+
     plist_file_path = os.path.expanduser("~/Library/Services/Generate Directory Tree.workflow/Contents/Info.plist")
     
     try:
@@ -207,6 +577,8 @@ def remove_context_menu_macos():
         messagebox.showerror("Error", f"Failed to remove service: {e}")
 
 def add_context_menu():
+    from tkinter import messagebox
+
     if CURRENT_OS == "windows":
         return add_context_menu_windows()
     elif CURRENT_OS == "linux":
@@ -217,6 +589,8 @@ def add_context_menu():
         messagebox.showerror("Error", f"Context menu integration not supported on {CURRENT_OS}")
 
 def remove_context_menu():
+    from tkinter import messagebox
+
     if CURRENT_OS == "windows":
         return remove_context_menu_windows()
     elif CURRENT_OS == "linux":
@@ -227,34 +601,110 @@ def remove_context_menu():
         messagebox.showerror("Error", f"Context menu integration not supported on {CURRENT_OS}")
 
 def gui():
+    import queue
+    import threading
+    import tkinter as tk
+    from tkinter import filedialog, messagebox
+
     def browse_folder():
         folder_selected = filedialog.askdirectory()
         if folder_selected:
             folder_path.set(folder_selected)
 
-    def generate():
-        path = folder_path.get()
+    def generate(path=None):
+        path = path or folder_path.get()
         if not path:
             messagebox.showwarning("Warning", "Please select a folder.")
             return
+        if running[0] is not None:
+            messagebox.showwarning("Warning", "A tree is already being generated.")
+            return
         
         format = format_var.get()
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        base_name = os.path.basename(path)
-        output_file = os.path.join(path, f"{base_name}_tree_{timestamp}.{format}")
-        
-        if generate_tree(path, output_file, format):
-            messagebox.showinfo("Success", f"Tree structure saved to:\n{output_file}")
-        else:
-            messagebox.showerror("Error", "Failed to generate tree structure.")
+        # Named like the CLI's output, e.g. .html for html-lazy
+        output_file = _output_path(path, renderers.get_renderer(format).extension, timestamp)
+
+        # The scan runs in a worker thread; it only talks to Tk through the
+        # updates queue, which the main loop polls
+        cancel = threading.Event()
+        updates = queue.Queue()
+        started = time.monotonic()
+        last_update = [0.0]
+
+        def progress(entries, current):
+            now = time.monotonic()
+            if now - last_update[0] >= PROGRESS_INTERVAL:
+                last_update[0] = now
+                updates.put(("progress", entries, current))
+
+        def work():
+            updates.put(("done", generate_tree(path, output_file, TreeOptions(format), progress=progress,
+                                               cancel=cancel)))
+
+        def poll():
+            try:
+                while True:
+                    message = updates.get_nowait()
+                    if message[0] == "progress":
+                        entries, current = message[1:]
+                        rate = entries / max(time.monotonic() - started, 1e-6)
+                        status_var.set(f"{entries:,} entries, {rate:,.0f}/s\n{_shorten(current)}")
+                    else:
+                        finish(message[1])
+                        return
+            except queue.Empty:
+                pass
+            root.after(int(PROGRESS_INTERVAL * 1000), poll)
+
+        def finish(success):
+            running[0] = None
+            generate_button.config(state="normal")
+            cancel_button.config(state="disabled")
+            if cancel.is_set():
+                status_var.set("Cancelled")
+            elif success:
+                status_var.set(f"Done in {time.monotonic() - started:.1f} s")
+                messagebox.showinfo("Success", f"Tree structure saved to:\n{output_file}")
+            else:
+                status_var.set("")
+                messagebox.showerror("Error", "Failed to generate tree structure.")
+
+        running[0] = cancel
+        generate_button.config(state="disabled")
+        cancel_button.config(state="normal")
+        status_var.set("Scanning...")
+        threading.Thread(target=work, daemon=True).start()
+        poll()
+
+    def preview():
+        path = folder_path.get()
+        if not path or not os.path.isdir(path):
+            messagebox.showwarning("Warning", "Please select a folder.")
+            return
+        import tree_preview
+        if not preview_cache:
+            preview_cache.append(tree_preview.ListingCache())
+        tree_preview.open_preview(root, path, generate, preview_cache[0])
+
+    def cancel_generation():
+        if running[0] is not None:
+            running[0].set()
+            status_var.set("Cancelling...")
+
+    def close():
+        cancel_generation()
+        root.destroy()
 
     def check_for_updates():
-        if UPDATER_AVAILABLE:
-            check_for_updates_gui(root)
-        else:
+        try:
+            from updater import check_for_updates_gui
+        except ImportError:
             messagebox.showinfo("Updater Not Available",
                               "Auto-updater is not available.\n"
                               "Please check the project repository for updates.")
+        else:
+            check_for_updates_gui(root)
 
     def show_about():
         about_text = f"""Directory Tree Generator v1.0.0
@@ -276,7 +726,12 @@ For more information, visit the project repository."""
 
     root = tk.Tk()
     root.title(f"Directory Tree Generator - {CURRENT_OS.title()}")
-    root.geometry("400x250")
+    root.geometry("420x500")
+    root.protocol("WM_DELETE_WINDOW", close)
+    # Cancel event of the generation in progress, if any
+    running = [None]
+    # Directory listings shared by all preview windows, created on first use
+    preview_cache = []
 
     # Create menu bar
     menubar = tk.Menu(root)
@@ -304,22 +759,43 @@ For more information, visit the project repository."""
     tk.Label(root, text="Select Folder:").pack(pady=5)
     tk.Entry(root, textvariable=folder_path, width=50).pack(pady=5)
     tk.Button(root, text="Browse", command=browse_folder).pack(pady=5)
+    tk.Button(root, text="Preview", command=preview).pack(pady=5)
 
     tk.Label(root, text="Output Format:").pack(pady=5)
     format_var = tk.StringVar(value="text")
-    tk.Radiobutton(root, text="Plain Text", variable=format_var, value="text").pack(anchor="w")
-    tk.Radiobutton(root, text="Markdown", variable=format_var, value="markdown").pack(anchor="w")
-    tk.Radiobutton(root, text="HTML", variable=format_var, value="html").pack(anchor="w")
+    for name in renderers.renderer_names():
+        label = renderers.get_renderer(name).label or name
+        tk.Radiobutton(root, text=label, variable=format_var, value=name).pack(anchor="w")
 
-    tk.Button(root, text="Generate Tree", command=generate).pack(pady=20)
+    generate_button = tk.Button(root, text="Generate Tree", command=generate)
+    generate_button.pack(pady=(20, 5))
+    cancel_button = tk.Button(root, text="Cancel", command=cancel_generation, state="disabled")
+    cancel_button.pack()
+    status_var = tk.StringVar()
+    tk.Label(root, textvariable=status_var, justify="left").pack(pady=5)
     tk.Button(root, text="Add Context Menu Entry", command=add_context_menu).pack(side="left", padx=10)
     tk.Button(root, text="Remove Context Menu Entry", command=remove_context_menu).pack(side="right", padx=10)
 
     root.mainloop()
 
+def _shorten(path, width=60):
+    # Keeps the end of long paths, which is the part that changes
+    return path if len(path) <= width else "..." + path[-(width - 3):]
+
 if __name__ == "__main__":
     import argparse
+
+    # Needed for --processes in frozen (PyInstaller) builds; multiprocessing
+    # is not imported otherwise, it is slow to import
+    if getattr(sys, "frozen", False):
+        import multiprocessing
+        multiprocessing.freeze_support()
     
+    # "dir_tree.py diff OLD NEW" has its own options
+    if len(sys.argv) > 1 and sys.argv[1] == "diff":
+        import tree_diff
+        sys.exit(tree_diff.main(sys.argv[2:]))
+
     parser = argparse.ArgumentParser(
         description="Generate directory tree structure",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -327,20 +803,131 @@ if __name__ == "__main__":
 Examples:
   python dir_tree.py /path/to/directory                    # Generate text tree
   python dir_tree.py /path/to/directory -f markdown       # Generate markdown tree
+  python dir_tree.py /path/to/directory -f ndjson         # One JSON object per entry
   python dir_tree.py /path/to/directory -o output.txt     # Specify output file
+  python dir_tree.py /path/to/directory -o tree.txt.gz    # Compressed while writing (.gz/.bz2/.xz/.zst)
+  python dir_tree.py /path/to/directory -o - | less       # Stream to stdout
+  python dir_tree.py ~/src/app ~/src/lib -o trees/        # Several directories in one run
+  python dir_tree.py --from-file projects.txt             # Directories listed in a file
+  python dir_tree.py /mnt/share --workers 16              # Parallel listing on NFS/SMB
+  python dir_tree.py /path/to/monorepo --processes 8      # Render subtrees on 8 cores
+  python dir_tree.py /path/to/directory --index           # Re-list only changed directories
+  python dir_tree.py /path/to/directory --watch           # Keep the output up to date (Linux)
+  python dir_tree.py /path/to/repo --gitignore --max-depth 3 --exclude "*.log"
+  python dir_tree.py /path/to/directory --sizes           # Sizes and directory totals
+  python dir_tree.py /path/to/directory --top 50          # 50 largest files and directories
+  python dir_tree.py /srv/releases --follow-symlinks      # Follow symlinks, cutting loops
+  python dir_tree.py /path/to/directory --progress        # Live counts and a timing summary
+  python dir_tree.py /path/to/directory --profile run.prof  # Profile, for bug reports
+  python dir_tree.py --serve --workers 8                  # Keep scans warm for --client runs
+  python dir_tree.py /path/to/directory --client          # Ask the server, else generate locally
+  python dir_tree.py /path/to/directory --save-snapshot home.dtsnap  # Keep the scan
+  python dir_tree.py --from-snapshot home.dtsnap -f html  # Render it again, no rescan
+  python dir_tree.py diff monday.dtsnap tuesday.dtsnap   # Added, removed and changed entries
   python dir_tree.py /path/to/directory --no-gui          # Force CLI mode
   python dir_tree.py --setup-context-menu                 # Setup context menu
   python dir_tree.py --remove-context-menu                # Remove context menu
         """
     )
     
-    parser.add_argument("directory", nargs="?", help="Directory path to generate tree for")
+    parser.add_argument("directories", nargs="*", metavar="directory",
+                       help="Directory paths to generate trees for")
+    parser.add_argument("--from-file",
+                       metavar="FILE",
+                       help="Also generate trees for the directories listed in FILE, one per line "
+                            "('-' reads stdin)")
     parser.add_argument("-f", "--format", 
-                       choices=["text", "markdown", "html"], 
+                       choices=renderers.renderer_names(), 
                        default="text",
                        help="Output format (default: text)")
     parser.add_argument("-o", "--output", 
-                       help="Output file path (default: auto-generated)")
+                       help="Output file path, - for stdout (default: auto-generated); "
+                            "with several directories, the folder to write their trees to")
+    parser.add_argument("--compress-level",
+                       type=int,
+                       metavar="N",
+                       help="Compression level for .gz/.bz2/.xz/.zst output (default: per format)")
+    parser.add_argument("--workers",
+                       type=int,
+                       default=1,
+                       metavar="N",
+                       help="List directories with N threads, useful on network filesystems (default: 1)")
+    parser.add_argument("--processes",
+                       type=int,
+                       default=1,
+                       metavar="N",
+                       help="Render top-level subdirectories in N worker processes (default: 1)")
+    parser.add_argument("--index",
+                       action="store_true",
+                       help="Reuse cached listings of unchanged directories from the scan index")
+    parser.add_argument("--index-path",
+                       metavar="FILE",
+                       help="Scan index location (default: per-user cache directory); implies --index")
+    parser.add_argument("--max-depth",
+                       type=int,
+                       metavar="N",
+                       help="Do not list directories more than N levels below the start directory")
+    parser.add_argument("--exclude",
+                       action="append",
+                       default=[],
+                       metavar="GLOB",
+                       help="Skip files and directories matching GLOB (repeatable)")
+    parser.add_argument("--include",
+                       action="append",
+                       default=[],
+                       metavar="GLOB",
+                       help="Only show files matching GLOB (repeatable)")
+    parser.add_argument("--gitignore",
+                       action="store_true",
+                       help="Skip entries ignored by .gitignore/.ignore files, and .git directories")
+    parser.add_argument("--sizes",
+                       action="store_true",
+                       help="Show file sizes and directory totals, apparent and allocated on disk")
+    parser.add_argument("--top",
+                       type=int,
+                       default=0,
+                       metavar="N",
+                       help="Append a summary of the N largest files and directories")
+    parser.add_argument("--follow-symlinks",
+                       action="store_true",
+                       help="Descend into symlinked directories, visiting each directory once")
+    parser.add_argument("--count-hardlinks-once",
+                       action="store_true",
+                       help="With --sizes/--top, count files with several hardlinks only once")
+    parser.add_argument("--progress",
+                       action="store_true",
+                       help="Report progress on stderr and end with a walk/render/write time summary")
+    parser.add_argument("--profile",
+                       metavar="FILE",
+                       help="Save a cProfile of the run to FILE and a timing summary to FILE.json")
+    parser.add_argument("--save-snapshot",
+                       metavar="FILE",
+                       help="Also save the scanned tree to FILE, to render it again with --from-snapshot")
+    parser.add_argument("--from-snapshot",
+                       metavar="FILE",
+                       help="Render the tree saved in FILE instead of scanning a directory")
+    parser.add_argument("--serve",
+                       action="store_true",
+                       help="Run a tree server on a Unix socket, keeping recent scans in memory")
+    parser.add_argument("--client",
+                       action="store_true",
+                       help="Have the tree server generate the trees, generating locally if it is not running")
+    parser.add_argument("--socket",
+                       metavar="PATH",
+                       help="Tree server socket (default: per-user runtime directory)")
+    parser.add_argument("--cache-size",
+                       type=int,
+                       default=16,
+                       metavar="N",
+                       help="In --serve mode, keep the scans of N trees (default: 16)")
+    parser.add_argument("--watch",
+                       action="store_true",
+                       help="Keep the output up to date as the directory changes (Linux only)")
+    parser.add_argument("--debounce",
+                       type=float,
+                       default=1.0,
+                       metavar="SECONDS",
+                       help="In --watch mode, rewrite after this long without changes (default: 1.0)")
     parser.add_argument("--no-gui", 
                        action="store_true",
                        help="Force CLI mode even if GUI is available")
@@ -376,25 +963,218 @@ Examples:
             print(f"Context menu integration not supported on {CURRENT_OS}")
         sys.exit(0)
     
+    if args.serve:
+        import tree_server
+        if args.workers < 1 or args.cache_size < 1:
+            print("Error: --workers and --cache-size must be at least 1")
+            sys.exit(1)
+        try:
+            tree_server.serve(write_tree, args.socket, args.workers, tree_server.ScanCache(args.cache_size))
+        except (tree_server.ServerError, OSError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        sys.exit(0)
+
     # Handle directory tree generation
-    if args.directory:
-        if not os.path.isdir(args.directory):
-            print(f"Error: '{args.directory}' is not a valid directory")
+    directories = list(args.directories)
+    if args.from_file:
+        try:
+            directories += read_manifest(args.from_file)
+        except OSError as e:
+            print(f"Error: cannot read {args.from_file}: {e}")
             sys.exit(1)
-        
-        # Determine output file
-        if args.output:
-            output_file = args.output
-        else:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            base_name = os.path.basename(args.directory)
-            extension = "txt" if args.format == "text" else args.format
-            output_file = os.path.join(args.directory, f"{base_name}_tree_{timestamp}.{extension}")
-        
-        if generate_tree(args.directory, output_file, args.format):
+        if not directories:
+            print(f"Error: no directories listed in {args.from_file}")
+            sys.exit(1)
+
+    # One set of scan and render options serves every tree below
+    tree_filter = None
+    if args.max_depth is not None or args.exclude or args.include or args.gitignore:
+        tree_filter = TreeFilter(args.max_depth, args.exclude, args.include, args.gitignore)
+    options = TreeOptions(args.format, args.sizes, args.top, args.workers, args.processes, args.follow_symlinks,
+                          args.count_hardlinks_once, args.compress_level, tree_filter)
+
+    if args.from_snapshot:
+        status = _status_stream(args.output)
+        if directories:
+            print("Error: --from-snapshot takes no directories", file=status)
+            sys.exit(1)
+        if args.top < 0:
+            print("Error: --top must not be negative", file=status)
+            sys.exit(1)
+        # Without -o, the tree is written next to the snapshot and named after it
+        snapshot_path = os.path.abspath(args.from_snapshot)
+        output_file = args.output or _output_path(
+            os.path.splitext(snapshot_path)[0], options.renderer().extension,
+            datetime.now().strftime("%Y%m%d_%H%M%S"), os.path.dirname(snapshot_path))
+        try:
+            if not render_snapshot(args.from_snapshot, output_file, options):
+                sys.exit(1)
+        except BrokenPipeError:
+            _close_broken_stdout()
+            sys.exit(1)
+        if output_file != "-":
             print(f"Directory tree generated successfully: {output_file}")
-        else:
-            print("Failed to generate directory tree")
+        sys.exit(0)
+
+    if directories:
+        batch = len(directories) > 1
+        # With -o -, the trees go to stdout and messages to stderr
+        status = _status_stream(args.output)
+        if args.workers < 1 or args.processes < 1:
+            print("Error: --workers and --processes must be at least 1", file=status)
+            sys.exit(1)
+        if args.top < 0:
+            print("Error: --top must not be negative", file=status)
+            sys.exit(1)
+        if batch and (args.watch or args.save_snapshot):
+            print("Error: --watch and --save-snapshot take a single directory", file=status)
+            sys.exit(1)
+
+        # Determine output files; with several directories, -o names a
+        # directory to write all trees to
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        extension = options.renderer().extension
+        output_dir = None
+        if batch and args.output and args.output != "-":
+            output_dir = args.output
+            if os.path.exists(output_dir) and not os.path.isdir(output_dir):
+                print(f"Error: '{output_dir}' is not a directory; with several directories, "
+                      f"-o names the folder to write their trees to")
+                sys.exit(1)
+            try:
+                os.makedirs(output_dir, exist_ok=True)
+            except OSError as e:
+                print(f"Error: cannot create output folder {output_dir}: {e}")
+                sys.exit(1)
+        jobs = []
+        failures = 0
+        for directory in directories:
+            if not os.path.isdir(directory):
+                print(f"Error: '{directory}' is not a valid directory", file=status)
+                failures += 1
+            elif args.output and not output_dir:
+                jobs.append((directory, args.output))
+            else:
+                taken = {output_file for _, output_file in jobs}
+                jobs.append((directory, _output_path(directory, extension, timestamp, output_dir, taken)))
+        if not jobs:
+            sys.exit(1)
+
+        if args.compress_level is not None and not any(compression.detect(output_file) for _, output_file in jobs):
+            print("Warning: --compress-level only applies to .gz, .bz2, .xz and .zst output files",
+                  file=status)
+
+        if args.watch:
+            start_path, output_file = jobs[0]
+            if output_file == "-":
+                print("Error: --watch needs an output file", file=status)
+                sys.exit(1)
+            # Only a single file can be replaced atomically on every rewrite
+            if len(options.renderer().output_paths(output_file)) > 1:
+                print(f"Error: --watch cannot rewrite {args.format} output, which is more than one file")
+                sys.exit(1)
+            if options.tree_filter is not None:
+                print("Warning: filtering options are not applied in --watch mode")
+            if options.follow_symlinks:
+                print("Warning: symlinks are not followed in --watch mode")
+            if args.progress or args.profile:
+                print("Warning: --progress and --profile do not apply in --watch mode")
+            try:
+                watch_tree(start_path, output_file, options, args.debounce)
+            except KeyboardInterrupt:
+                sys.exit(0)
+            except Exception as e:
+                print(f"Error: {e}")
+                sys.exit(1)
+
+        # One scan index serves all directories
+        index = None
+        if args.index or args.index_path:
+            import scan_index
+            try:
+                index = scan_index.ScanIndex(args.index_path)
+            except Exception as e:
+                print(f"Warning: scan index not available: {e}", file=status)
+
+        # Each tree is counted and timed with --progress (reported as it
+        # runs), --profile and for the totals of a batch
+        stats_stream = None
+        if args.progress:
+            stats_stream = sys.stderr
+        elif args.profile or batch:
+            stats_stream = io.StringIO()
+        totals = progress.RunStats(status) if stats_stream is not None else None
+
+        if args.client:
+            if (options.count_hardlinks_once or args.progress or args.profile or index is not None
+                    or args.save_snapshot):
+                print("Warning: the tree server does not support --count-hardlinks-once, --progress, "
+                      "--profile, --index or --save-snapshot, generating locally", file=status)
+            else:
+                import tree_server
+                local_jobs = []
+                try:
+                    for position, (start_path, output_file) in enumerate(jobs):
+                        try:
+                            answer = tree_server.request_tree(start_path, output_file, options, args.socket)
+                        except tree_server.ServerError as e:
+                            # The rest, this one included, is generated here
+                            print(f"Warning: {e}, generating locally", file=status)
+                            local_jobs = jobs[position:]
+                            break
+                        if totals is not None:
+                            totals.directories += answer["directories"]
+                            totals.files += answer["files"]
+                        if output_file != "-":
+                            print(f"Directory tree generated successfully: {output_file}")
+                        elif batch:
+                            sys.stdout.write("\n")
+                except BrokenPipeError:
+                    _close_broken_stdout()
+                    sys.exit(1)
+                jobs = local_jobs
+
+        def generate_all():
+            # Returns the number of trees that failed
+            failed = 0
+            for start_path, output_file, success, stats in generate_trees(
+                    jobs, options, stats_stream, index, args.save_snapshot):
+                if totals is not None:
+                    totals.add(stats)
+                if not success:
+                    failed += 1
+                    print(f"Failed to generate directory tree{f': {start_path}' if batch else ''}",
+                          file=status)
+                elif output_file != "-":
+                    print(f"Directory tree generated successfully: {output_file}")
+                elif batch:
+                    # Trees streamed one after another are kept apart
+                    sys.stdout.write("\n")
+            return failed
+
+        try:
+            if args.profile:
+                import profiling
+                failures += profiling.profile_call(args.profile, totals, generate_all)
+            else:
+                failures += generate_all()
+        except BrokenPipeError:
+            _close_broken_stdout()
+            sys.exit(1)
+        finally:
+            if index is not None:
+                index.evict()
+                index.close()
+
+        if batch:
+            print(f"Generated {len(directories) - failures} of {len(directories)} directory trees",
+                  file=status)
+        if totals is not None:
+            totals.finish(summary=batch)
+        if args.profile:
+            print(f"Profile saved: {args.profile} (summary in {args.profile}.json)", file=status)
+        if failures:
             sys.exit(1)
     else:
         # No directory provided, check if we should show GUI
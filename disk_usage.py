@@ -0,0 +1,155 @@
+"""
+Disk usage accounting for Directory Tree Generator
+Collects file sizes during the walk and rolls them up into directory totals
+"""
+
+import heapq
+
+
+def format_size(size):
+    """Format a byte count with binary units, e.g. 1.5 KiB"""
+    if size < 1024:
+        return f"{size} B"
+    for unit in ("KiB", "MiB", "GiB", "TiB"):
+        size /= 1024
+        if size < 1024 or unit == "TiB":
+            return f"{size:.1f} {unit}"
+
+
+def format_usage(apparent, allocated):
+    """Format apparent and allocated sizes for display next to an entry"""
+    return f"{format_size(apparent)}, {format_size(allocated)} on disk"
+
+
+def file_usage(entry):
+    """Return (apparent, allocated) bytes of a directory entry, without following symlinks
+
+    Allocated size comes from st_blocks; where that is not available
+    (Windows) the apparent size is used.
+    """
+    try:
+        st = entry.stat(follow_symlinks=False)
+    except OSError:
+        return 0, 0
+    blocks = getattr(st, "st_blocks", None)
+    return st.st_size, (blocks * 512 if blocks is not None else st.st_size)
+
+
+class DirectoryTotals:
+    """Running size totals of the directories that are still being walked
+
+    The walk is top-down, so when it reaches a directory at depth d every
+    open directory at depth d or deeper is complete: its totals are final
+    and are added to its parent. Only the chain of open ancestors is kept.
+    Directories are tracked even when no sizes are added, so renderers can
+    close them.
+    Files and completed directories are reported to largest, if given.
+    With count_hardlinks_once, a file with several links is only counted
+    the first time one of them is seen.
+    """
+
+    def __init__(self, largest=None, count_hardlinks_once=False):
+        self.largest = largest
+        self.links = LinkSet() if count_hardlinks_once else None
+        # [depth, path, apparent, allocated] per open directory
+        self._open = []
+
+    def enter(self, path, depth):
+        """Open a directory; returns the directories this completed, see leave()"""
+        closed = self.leave(depth)
+        self._open.append([depth, path, 0, 0])
+        return closed
+
+    def leave(self, depth=0):
+        """Complete the open directories at depth or deeper
+
+        Returns (path, depth, apparent, allocated) for each, innermost first.
+        """
+        closed = []
+        while self._open and self._open[-1][0] >= depth:
+            level, path, apparent, allocated = self._open.pop()
+            self.add(apparent, allocated)
+            closed.append((path, level, apparent, allocated))
+            if self.largest is not None:
+                self.largest.add_directory(path, apparent, allocated)
+        return closed
+
+    def add_file(self, entry, apparent, allocated):
+        """Add a file to the innermost open directory; returns False if it was not counted"""
+        if self.links is not None and not self.links.first(entry):
+            return False
+        self.add(apparent, allocated)
+        if self.largest is not None:
+            self.largest.add_file(entry.path, apparent, allocated)
+        return True
+
+    def add(self, apparent, allocated):
+        """Add sizes to the innermost open directory"""
+        if self._open:
+            current = self._open[-1]
+            current[2] += apparent
+            current[3] += allocated
+
+
+class LinkSet:
+    """Identities of files with more than one hardlink that were already counted"""
+
+    def __init__(self):
+        self._seen = set()
+
+    def first(self, entry):
+        """Return False if entry is a hardlink to a file seen before"""
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except OSError:
+            return True
+        if st.st_nlink < 2:
+            # Files with a single link cannot repeat, so they are not stored
+            return True
+        key = (st.st_dev << 64) | st.st_ino
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        return True
+
+
+class LargestEntries:
+    """The count largest files and directories by apparent size
+
+    Each kind is kept in a min-heap of at most count items, so memory does
+    not depend on the number of entries and nothing is sorted until the
+    end.
+    """
+
+    def __init__(self, count):
+        self.count = count
+        # (apparent, allocated, path) min-heaps
+        self._files = []
+        self._dirs = []
+
+    def add_file(self, path, apparent, allocated):
+        self._push(self._files, (apparent, allocated, path))
+
+    def add_directory(self, path, apparent, allocated):
+        self._push(self._dirs, (apparent, allocated, path))
+
+    def merge(self, other):
+        """Add everything another LargestEntries kept, e.g. from a shard"""
+        for item in other._files:
+            self._push(self._files, item)
+        for item in other._dirs:
+            self._push(self._dirs, item)
+
+    def files(self):
+        """Return [(path, apparent, allocated)], largest first"""
+        return [(path, apparent, allocated) for apparent, allocated, path in sorted(self._files, reverse=True)]
+
+    def directories(self):
+        """Return [(path, apparent, allocated)], largest first"""
+        return [(path, apparent, allocated) for apparent, allocated, path in sorted(self._dirs, reverse=True)]
+
+    def _push(self, heap, item):
+        if len(heap) < self.count:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
@@ -0,0 +1,122 @@
+"""
+Profiling for Directory Tree Generator
+Runs a call under cProfile, including the threads it starts, and saves pstats with a JSON summary
+"""
+
+import cProfile
+import json
+import platform
+import pstats
+import sys
+import threading
+import time
+from datetime import datetime
+
+# Version of the JSON summary layout
+SUMMARY_VERSION = 1
+# Functions listed in the summary, by own time
+TOP_FUNCTIONS = 25
+# Built-in calls that mostly stand for a system call, and their names in
+# the summary; posix and nt functions are both listed as os
+OPERATIONS = {
+    "os.scandir": "listings",
+    "os.stat": "stat",
+    "os.lstat": "lstat",
+    "os.DirEntry.stat": "entry_stat",
+    "io.open": "open",
+    "_io.FileIO.write": "write",
+    "sqlite3.Connection.execute": "index_queries",
+}
+
+
+def profile_call(profile_file, run_stats, func, *args, **kwargs):
+    """Call func under cProfile and return its result, saving the profile even if it fails
+
+    The pstats go to profile_file and a JSON summary to profile_file +
+    ".json": phase times and counts from run_stats (a progress.RunStats
+    that func is expected to fill), the number of calls of each of OPERATIONS
+    and the functions with the most own time. Threads started by func,
+    like the walker's listing threads, are profiled too; shard processes
+    are not, their time shows up as waiting in the main process.
+    """
+    # Since 3.12 cProfile uses sys.monitoring, which sees every thread, and
+    # only one profiler can be enabled at a time
+    per_thread = sys.version_info < (3, 12)
+    profilers = []
+    lock = threading.Lock()
+
+    def start_thread_profiler(frame, event, arg):
+        # Runs once at the start of each new thread and replaces itself
+        profiler = cProfile.Profile()
+        with lock:
+            profilers.append(profiler)
+        profiler.enable()
+
+    main = cProfile.Profile()
+    started = time.perf_counter()
+    if per_thread:
+        threading.setprofile(start_thread_profiler)
+    main.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        main.disable()
+        if per_thread:
+            threading.setprofile(None)
+        elapsed = time.perf_counter() - started
+        profile = pstats.Stats(main)
+        with lock:
+            for profiler in profilers:
+                profile.add(profiler)
+        profile.dump_stats(profile_file)
+        with open(profile_file + ".json", 'w', encoding='utf-8') as f:
+            json.dump(summarize(profile, run_stats, elapsed), f, indent=2)
+
+
+def summarize(profile, stats, elapsed):
+    """Return the JSON summary of a pstats.Stats and the RunStats of the same run"""
+    operations = dict.fromkeys(OPERATIONS.values(), 0)
+    functions = []
+    for (filename, line, name), (_, calls, own, cumulative, _) in profile.stats.items():
+        if filename == "~":
+            operation = OPERATIONS.get(_builtin_name(name))
+            if operation is not None:
+                operations[operation] += calls
+        functions.append((own, cumulative, calls, pstats.func_std_string((filename, line, name))))
+    functions.sort(reverse=True)
+
+    return {
+        "version": SUMMARY_VERSION,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "command": sys.argv,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "elapsed": elapsed,
+        # Measured under the profiler, so slower than in a normal run
+        "phases": {"walk": stats.walk_time, "render": stats.render_time, "write": stats.write_time},
+        "counts": {
+            "directories": stats.directories,
+            "files": stats.files,
+            "bytes_written": stats.bytes_written,
+            "sharded": stats.sharded,
+        },
+        "operations": operations,
+        "top_functions": [
+            {"function": function, "calls": calls, "own_time": own, "cumulative_time": cumulative}
+            for own, cumulative, calls, function in functions[:TOP_FUNCTIONS]
+        ],
+    }
+
+
+def _builtin_name(name):
+    # "<built-in method posix.scandir>" -> "os.scandir",
+    # "<method 'stat' of 'posix.DirEntry' objects>" -> "os.DirEntry.stat"
+    if name.startswith("<built-in method "):
+        name = name[len("<built-in method "):-1]
+    elif name.startswith("<method '") and name.endswith(" objects>"):
+        method, _, owner = name[len("<method '"):-len(" objects>")].partition("' of '")
+        name = owner.rstrip("'") + "." + method
+    for module in ("posix.", "nt."):
+        if name.startswith(module):
+            return "os." + name[len(module):]
+    return name
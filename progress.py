@@ -0,0 +1,159 @@
+"""
+Progress reporting for Directory Tree Generator
+Counts entries and output bytes of a run and splits its time into walk, render and write
+"""
+
+import io
+import sys
+import time
+
+import disk_usage
+
+# Seconds between progress lines on a terminal; logs get one per second
+REPORT_INTERVAL = 0.25
+
+
+class RunStats:
+    """Counters and phase timers of one generate_tree run, reported to a stream
+
+    walk is the time spent waiting for directory listings, write the time
+    spent in the output file's raw writes, compression included, and render
+    the rest of the run. Bytes written are counted before compression. On
+    a terminal the progress line is rewritten in place, otherwise a line
+    is appended at most once a second.
+    """
+
+    def __init__(self, stream=None, interval=REPORT_INTERVAL):
+        self.stream = stream if stream is not None else sys.stderr
+        self.live = hasattr(self.stream, "isatty") and self.stream.isatty()
+        self.interval = interval if self.live else max(interval, 1.0)
+        self.directories = 0
+        self.files = 0
+        self.bytes_written = 0
+        self.walk_time = 0.0
+        self.write_time = 0.0
+        self.started = time.perf_counter()
+        self.finished = None
+        self.sharded = False
+        self._last_report = self.started
+        self._line_length = 0
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def render_time(self):
+        return max(self.elapsed - self.walk_time - self.write_time, 0.0)
+
+    def walk(self, entries):
+        """Pass walk entries through, timing the walker and counting entries"""
+        clock = time.perf_counter
+        iterator = iter(entries)
+        try:
+            while True:
+                start = clock()
+                try:
+                    entry = next(iterator)
+                except StopIteration:
+                    self.walk_time += clock() - start
+                    return
+                now = clock()
+                self.walk_time += now - start
+                self.directories += 1
+                self.files += len(entry[3])
+                self._maybe_report(now)
+                yield entry
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    def add_shard(self, directories, files, waited):
+        """Count a subtree rendered by a shard process, waited seconds for its result"""
+        self.sharded = True
+        self.directories += directories
+        self.files += files
+        self.walk_time += waited
+        self._maybe_report(time.perf_counter())
+
+    def add(self, other):
+        """Add the counts and times of another run, e.g. for the totals of a batch"""
+        self.directories += other.directories
+        self.files += other.files
+        self.bytes_written += other.bytes_written
+        self.walk_time += other.walk_time
+        self.write_time += other.write_time
+        self.sharded = self.sharded or other.sharded
+
+    def wrap_raw(self, raw):
+        """Return a raw output stream that times and counts writes to raw"""
+        return _TimedRaw(raw, self)
+
+    def finish(self, summary=True):
+        """Stop the clock and end the progress line, with a summary if asked"""
+        self.finished = time.perf_counter()
+        if self.live and self._line_length:
+            self.stream.write("\n")
+        if summary:
+            self.stream.write(self.summary() + "\n")
+        self.stream.flush()
+
+    def summary(self):
+        entries = self.directories + self.files
+        elapsed = self.elapsed
+        lines = [
+            f"Scanned {self.directories:,} directories and {self.files:,} files in {elapsed:.2f} s "
+            f"({entries / max(elapsed, 1e-9):,.0f} entries/s), "
+            f"wrote {disk_usage.format_size(self.bytes_written)}"
+        ]
+        phases = (("walk", self.walk_time), ("render", self.render_time), ("write", self.write_time))
+        lines.append("Time: " + ", ".join(
+            f"{name} {seconds:.2f} s ({seconds / max(elapsed, 1e-9):.0%})" for name, seconds in phases
+        ))
+        if self.sharded:
+            lines.append("Walk time includes waiting for shard processes")
+        return "\n".join(lines)
+
+    def _maybe_report(self, now):
+        if now - self._last_report < self.interval:
+            return
+        self._last_report = now
+        entries = self.directories + self.files
+        elapsed = now - self.started
+        line = (f"{self.directories:,} directories, {self.files:,} files, "
+                f"{entries / max(elapsed, 1e-9):,.0f} entries/s, "
+                f"{disk_usage.format_size(self.bytes_written)} written, {elapsed:.1f} s")
+        if self.live:
+            # Padded so a shorter line fully covers the previous one
+            self.stream.write("\r" + line.ljust(self._line_length))
+            self._line_length = len(line)
+        else:
+            self.stream.write(line + "\n")
+        self.stream.flush()
+
+
+class _TimedRaw(io.RawIOBase):
+    """Raw output stream that adds its write time and byte count to a RunStats"""
+
+    def __init__(self, raw, stats):
+        self._raw = raw
+        self._stats = stats
+        self.name = getattr(raw, "name", None)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        start = time.perf_counter()
+        written = self._raw.write(data)
+        self._stats.write_time += time.perf_counter() - start
+        self._stats.bytes_written += written
+        return written
+
+    def close(self):
+        if not self.closed:
+            start = time.perf_counter()
+            self._raw.close()
+            self._stats.write_time += time.perf_counter() - start
+        super().close()
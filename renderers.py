@@ -0,0 +1,537 @@
+"""
+Output formats for Directory Tree Generator
+Each format is a Renderer, looked up once per run in a registry of format names
+"""
+
+import html
+import json
+import os
+import re
+from string import Template
+
+import disk_usage
+
+_RENDERERS = {}
+
+
+def register_renderer(name, renderer_class):
+    """Make a Renderer subclass available as output format name
+
+    Shard processes look formats up by name, so renderers used with
+    --processes should be registered when their module is imported.
+    """
+    _RENDERERS[name] = renderer_class
+
+
+def renderer_names():
+    """Return the registered format names, in registration order"""
+    return list(_RENDERERS)
+
+
+def get_renderer(format, sizes=False):
+    """Return a new renderer for format; raises ValueError for unknown formats"""
+    try:
+        renderer_class = _RENDERERS[format]
+    except KeyError:
+        raise ValueError(f"Unknown output format: {format}")
+    return renderer_class(sizes)
+
+
+class Renderer:
+    """Writes one tree in one output format
+
+    The hooks are called in walk order: begin(), then for every directory
+    directory() and file() for each of its files, close_directory() once
+    the walk has left a directory, summary() for the largest entries and
+    finally end(). usage is an (apparent, allocated) pair when sizes are
+    shown and None otherwise.
+    """
+
+    label = None
+    extension = "txt"
+    # Whether output of shard processes can be spliced in with resume()
+    shardable = True
+
+    def __init__(self, sizes=False):
+        self.sizes = sizes
+
+    def output_paths(self, output_file):
+        """Return the paths written for output_file, which the walk leaves out"""
+        return (output_file,)
+
+    def begin(self, f):
+        """Write the document header"""
+
+    def resume(self, after_sibling):
+        """Continue a tree another renderer started, e.g. in a shard
+
+        after_sibling tells whether an entry at the level of the first
+        directory to be written was already written.
+        """
+
+    def directory(self, f, path, level):
+        raise NotImplementedError
+
+    def file(self, f, entry, level, usage=None, counted=True):
+        """Write a file of the directory at level; counted is False for a repeated hardlink"""
+        raise NotImplementedError
+
+    def files(self, f, entries, level):
+        """Write all files of the directory at level, when no sizes are collected"""
+        for entry in entries:
+            self.file(f, entry, level)
+
+    def close_directory(self, f, path, level, usage=None):
+        """Called once all contents of a directory were written"""
+
+    def summary(self, f, count, files, directories):
+        """Write the largest files and directories, [(path, apparent, allocated)] largest first"""
+
+    def end(self, f):
+        """Write the document footer"""
+
+
+class LineRenderer(Renderer):
+    """Base for formats with one line per entry
+
+    Lines are joined with newlines, without one after the last line.
+    Subclasses provide the line for each kind of entry; file lines are
+    split into the text before and after the name, which only depends on
+    the level, so a directory's files are written in one tight loop.
+    """
+
+    def __init__(self, sizes=False):
+        super().__init__(sizes)
+        self.separator = ""
+
+    def resume(self, after_sibling):
+        # The start directory's line always comes first
+        self.separator = "\n"
+
+    def directory(self, f, path, level):
+        f.write(self.separator + self.directory_line(os.path.basename(path), level))
+        self.separator = "\n"
+
+    def file(self, f, entry, level, usage=None, counted=True):
+        name = entry.name
+        if usage is not None:
+            usage = disk_usage.format_usage(*usage)
+            name = f"{name} ({usage})" if counted else f"{name} ({usage}, hardlink counted once)"
+        prefix, suffix = self.file_affixes(level + 1)
+        f.write(f"\n{prefix}{name}{suffix}")
+
+    def files(self, f, entries, level):
+        prefix, suffix = self.file_affixes(level + 1)
+        prefix = "\n" + prefix
+        write = f.write
+        for entry in entries:
+            write(prefix + entry.name + suffix)
+
+    def close_directory(self, f, path, level, usage=None):
+        if usage is not None:
+            total = f"{os.path.basename(path)}/ total: {disk_usage.format_usage(*usage)}"
+            f.write("\n" + self.total_line(total, level + 1))
+
+    def directory_line(self, name, level):
+        raise NotImplementedError
+
+    def file_affixes(self, level):
+        """Return the text before and after a file name at level"""
+        raise NotImplementedError
+
+    def total_line(self, total, level):
+        raise NotImplementedError
+
+
+class TextRenderer(LineRenderer):
+    label = "Plain Text"
+
+    def directory_line(self, name, level):
+        return f"{'    |' * level}__{name}/"
+
+    def file_affixes(self, level):
+        return f"{'    |' * level}__", ""
+
+    def total_line(self, total, level):
+        return f"{'    |' * level}== {total}"
+
+    def summary(self, f, count, files, directories):
+        for kind, items in (("files", files), ("directories", directories)):
+            f.write(f"\n\nLargest {count} {kind}:")
+            for number, (path, apparent, allocated) in enumerate(items, 1):
+                f.write(f"\n    {number}. {path} ({disk_usage.format_usage(apparent, allocated)})")
+
+
+class MarkdownRenderer(LineRenderer):
+    label = "Markdown"
+    extension = "markdown"
+
+    def directory_line(self, name, level):
+        return f"{'    |' * level}- {name}/"
+
+    def file_affixes(self, level):
+        return f"{'    |' * level}- ", ""
+
+    def total_line(self, total, level):
+        return f"{'    |' * level}- *{total}*"
+
+    def summary(self, f, count, files, directories):
+        for kind, items in (("files", files), ("directories", directories)):
+            f.write(f"\n\n## Largest {count} {kind}\n")
+            for number, (path, apparent, allocated) in enumerate(items, 1):
+                f.write(f"\n{number}. `{path}` ({disk_usage.format_usage(apparent, allocated)})")
+
+
+class HtmlRenderer(LineRenderer):
+    label = "HTML"
+    extension = "html"
+
+    def begin(self, f):
+        f.write("<html><body>\n")
+
+    def directory_line(self, name, level):
+        return f"<div style='margin-left: {level * 20}px;'>{name}/</div>"
+
+    def file_affixes(self, level):
+        return f"<div style='margin-left: {level * 20}px;'>- ", "</div>"
+
+    def total_line(self, total, level):
+        return f"<div style='margin-left: {level * 20}px;'><i>{total}</i></div>"
+
+    def summary(self, f, count, files, directories):
+        for kind, items in (("files", files), ("directories", directories)):
+            f.write(f"\n<h3>Largest {count} {kind}</h3>\n<ol>")
+            for path, apparent, allocated in items:
+                f.write(f"\n<li>{html.escape(path)} ({disk_usage.format_usage(apparent, allocated)})</li>")
+            f.write("\n</ol>")
+
+    def end(self, f):
+        f.write("\n</body></html>")
+
+
+def _usage_fields(item, usage):
+    if usage is not None:
+        item["size"], item["allocated"] = usage
+    return item
+
+
+def _largest_items(items):
+    return [{"path": path, "size": apparent, "allocated": allocated} for path, apparent, allocated in items]
+
+
+class JsonRenderer(Renderer):
+    """One JSON document, {"tree": directory}, streamed entry by entry
+
+    A directory is {"name", "type": "directory", "children": [...]},
+    a file {"name", "type": "file"}; with sizes both get "size" and
+    "allocated" in bytes. Every entry starts on a new line.
+    """
+
+    label = "JSON"
+    extension = "json"
+
+    def __init__(self, sizes=False):
+        super().__init__(sizes)
+        # Whether the next entry follows a sibling and needs a comma
+        self._comma = False
+        self._tree_written = False
+
+    def begin(self, f):
+        f.write('{"tree": ')
+
+    def resume(self, after_sibling):
+        self._comma = after_sibling
+        self._tree_written = True
+
+    def directory(self, f, path, level):
+        name = json.dumps(os.path.basename(path))
+        f.write(f'{self._separator()}{{"name": {name}, "type": "directory", "children": [')
+        self._comma = False
+        self._tree_written = True
+
+    def file(self, f, entry, level, usage=None, counted=True):
+        item = _usage_fields({"name": entry.name, "type": "file"}, usage)
+        if not counted:
+            item["hardlink_counted_once"] = True
+        f.write(self._separator() + json.dumps(item))
+        self._comma = True
+
+    def close_directory(self, f, path, level, usage=None):
+        total = ""
+        if usage is not None:
+            total = f', "size": {usage[0]}, "allocated": {usage[1]}'
+        f.write(f"]{total}}}")
+        self._comma = True
+
+    def summary(self, f, count, files, directories):
+        self._finish_tree(f)
+        f.write(f',\n"largest_files": {json.dumps(_largest_items(files))}')
+        f.write(f',\n"largest_directories": {json.dumps(_largest_items(directories))}')
+
+    def end(self, f):
+        self._finish_tree(f)
+        f.write("}\n")
+
+    def _separator(self):
+        return ",\n" if self._comma else "\n"
+
+    def _finish_tree(self, f):
+        # A start directory that could not be listed leaves the tree empty
+        if not self._tree_written:
+            f.write("null")
+            self._tree_written = True
+
+
+class NdjsonRenderer(Renderer):
+    """Newline-delimited JSON, one object per entry in walk order
+
+    Objects have "type" ("directory", "file", "total", "largest_file" or
+    "largest_directory") and "path"; entries also have "depth". With sizes
+    files and totals carry "size" and "allocated" in bytes.
+    """
+
+    label = "NDJSON"
+    extension = "ndjson"
+
+    def __init__(self, sizes=False):
+        super().__init__(sizes)
+        self.separator = ""
+
+    def resume(self, after_sibling):
+        self.separator = "\n"
+
+    def directory(self, f, path, level):
+        self._write(f, {"type": "directory", "path": path, "depth": level})
+
+    def file(self, f, entry, level, usage=None, counted=True):
+        item = _usage_fields({"type": "file", "path": entry.path, "depth": level + 1}, usage)
+        if not counted:
+            item["hardlink_counted_once"] = True
+        self._write(f, item)
+
+    def close_directory(self, f, path, level, usage=None):
+        if usage is not None:
+            self._write(f, _usage_fields({"type": "total", "path": path, "depth": level}, usage))
+
+    def summary(self, f, count, files, directories):
+        for kind, items in (("largest_file", files), ("largest_directory", directories)):
+            for item in _largest_items(items):
+                self._write(f, {"type": kind, **item})
+
+    def end(self, f):
+        if self.separator:
+            f.write("\n")
+
+    def _write(self, f, item):
+        f.write(self.separator + json.dumps(item))
+        self.separator = "\n"
+
+
+class LazyHtmlRenderer(Renderer):
+    """A small HTML viewer that loads directory listings on demand
+
+    Listings go to JSONP chunk files in a "<output name>_files" directory
+    next to the page, each about CHUNK_BYTES large. A listing is written
+    when its directory is closed, so the references to its
+    subdirectories' listings, (chunk, record) pairs, are already known;
+    the page itself is written last, with the reference to the start
+    directory. Listings of more than RECORD_ENTRIES entries continue in
+    further records, which the viewer loads on request. Only the open
+    directories' listings are held in memory, and the browser only loads
+    and renders what is expanded.
+    """
+
+    label = "HTML (lazy, for large trees)"
+    extension = "html"
+    shardable = False
+    CHUNK_BYTES = 64 * 1024
+    RECORD_ENTRIES = 2000
+
+    def __init__(self, sizes=False):
+        super().__init__(sizes)
+        self._data_dir = None
+        self._chunk = []
+        self._chunk_bytes = 0
+        self._chunk_number = 0
+        # [name, subdirectory references, files] per open directory
+        self._open = []
+        self._root = None
+        self._summary = ""
+
+    def begin(self, f):
+        if not isinstance(f.name, str):
+            raise ValueError("html-lazy output needs an output file, it cannot be written to stdout")
+        self._data_dir = self._data_dir_of(f.name)
+
+    def output_paths(self, output_file):
+        return (output_file, self._data_dir_of(output_file))
+
+    @staticmethod
+    def _data_dir_of(output_file):
+        return os.path.splitext(output_file)[0] + "_files"
+
+    def directory(self, f, path, level):
+        self._open.append((os.path.basename(path) or path, [], []))
+
+    def file(self, f, entry, level, usage=None, counted=True):
+        if usage is None:
+            self._open[-1][2].append(entry.name)
+            return
+        usage = disk_usage.format_usage(*usage)
+        self._open[-1][2].append([entry.name, usage if counted else f"{usage}, hardlink counted once"])
+
+    def files(self, f, entries, level):
+        self._open[-1][2].extend(entry.name for entry in entries)
+
+    def close_directory(self, f, path, level, usage=None):
+        name, dirs, files = self._open.pop()
+        reference = [name] + self._write_listing(dirs, files)
+        if usage is not None:
+            reference.append(disk_usage.format_usage(*usage))
+        if self._open:
+            self._open[-1][1].append(reference)
+        else:
+            self._root = reference
+
+    def summary(self, f, count, files, directories):
+        parts = []
+        for kind, items in (("files", files), ("directories", directories)):
+            parts.append(f"<h3>Largest {count} {kind}</h3>\n<ol>")
+            for path, apparent, allocated in items:
+                usage = disk_usage.format_usage(apparent, allocated)
+                parts.append(f"<li>{html.escape(path)} ({usage})</li>")
+            parts.append("</ol>")
+        self._summary = "\n".join(parts)
+
+    def end(self, f):
+        if self._chunk:
+            self._flush()
+        root = self._root
+        f.write(_LAZY_PAGE.substitute(
+            title=html.escape(root[0] if root else ""),
+            data=_script_json(os.path.basename(self._data_dir) + "/"),
+            root=_script_json(root),
+            summary=self._summary,
+        ))
+
+    def _write_listing(self, dirs, files):
+        # Split into records of at most RECORD_ENTRIES entries, written
+        # last part first so each part can refer to the next one
+        parts = []
+        for start in range(0, max(len(dirs) + len(files), 1), self.RECORD_ENTRIES):
+            stop = start + self.RECORD_ENTRIES
+            parts.append((dirs[start:stop], files[max(start - len(dirs), 0):max(stop - len(dirs), 0)]))
+        reference = None
+        for part_dirs, part_files in reversed(parts):
+            record = {"d": part_dirs, "f": part_files}
+            if reference is not None:
+                record["m"] = reference
+            reference = self._add_record(json.dumps(record, separators=(",", ":")))
+        return reference
+
+    def _add_record(self, record):
+        if self._chunk and self._chunk_bytes + len(record) > self.CHUNK_BYTES:
+            self._flush()
+        self._chunk.append(record)
+        self._chunk_bytes += len(record)
+        return [self._chunk_number, len(self._chunk) - 1]
+
+    def _flush(self):
+        if self._chunk_number == 0:
+            # Created only now, after the walk has passed the output's
+            # directory, so the viewer does not list its own data
+            os.makedirs(self._data_dir, exist_ok=True)
+            # Chunks left over from an earlier, larger tree would never be read
+            for name in os.listdir(self._data_dir):
+                if re.fullmatch(r"chunk_\d+\.js", name):
+                    os.remove(os.path.join(self._data_dir, name))
+        chunk_file = os.path.join(self._data_dir, f"chunk_{self._chunk_number}.js")
+        with open(chunk_file, "w", encoding="utf-8") as chunk:
+            chunk.write(f"dirTreeChunk({self._chunk_number},[{','.join(self._chunk)}]);\n")
+        self._chunk_number += 1
+        self._chunk = []
+        self._chunk_bytes = 0
+
+
+def _script_json(value):
+    # JSON that is safe inside a <script> element
+    return json.dumps(value).replace("</", "<\\/")
+
+
+_LAZY_PAGE = Template("""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>$title</title>
+<style>
+body { font-family: monospace; }
+ul { list-style: none; margin: 0; padding-left: 20px; }
+.dir, .more { cursor: pointer; }
+.dir:before { content: "+ "; }
+.open > .dir:before { content: "- "; }
+.more { color: #06c; }
+</style></head><body>
+<ul id="tree"></ul>
+$summary
+<script>
+var DATA = $data, ROOT = $root, chunks = {}, waiting = {};
+function dirTreeChunk(number, records) {
+  chunks[number] = records;
+  (waiting[number] || []).forEach(function (callback) { callback(records); });
+  delete waiting[number];
+}
+function load(chunk, record, callback) {
+  if (chunks[chunk]) return callback(chunks[chunk][record]);
+  if (!waiting[chunk]) {
+    waiting[chunk] = [];
+    var script = document.createElement("script");
+    script.src = encodeURI(DATA) + "chunk_" + chunk + ".js";
+    document.head.appendChild(script);
+  }
+  waiting[chunk].push(function (records) { callback(records[record]); });
+}
+function item(text, className) {
+  var li = document.createElement("li"), span = document.createElement("span");
+  span.textContent = text;
+  if (className) span.className = className;
+  li.appendChild(span);
+  return li;
+}
+function fill(ul, record) {
+  record.d.forEach(function (dir) { ul.appendChild(directory(dir)); });
+  record.f.forEach(function (file) {
+    ul.appendChild(item(typeof file === "string" ? file : file[0] + " (" + file[1] + ")"));
+  });
+  if (record.m) {
+    var more = item("more...", "more");
+    more.onclick = function () {
+      ul.removeChild(more);
+      load(record.m[0], record.m[1], function (next) { fill(ul, next); });
+    };
+    ul.appendChild(more);
+  }
+}
+function directory(dir) {
+  var li = item(dir[0] + "/" + (dir.length > 3 ? " (" + dir[3] + ")" : ""), "dir"), ul = null;
+  li.firstChild.onclick = function () {
+    li.classList.toggle("open");
+    if (ul) { ul.hidden = !ul.hidden; return; }
+    ul = document.createElement("ul");
+    li.appendChild(ul);
+    load(dir[1], dir[2], function (record) { fill(ul, record); });
+  };
+  return li;
+}
+if (ROOT) {
+  var root = directory(ROOT);
+  document.getElementById("tree").appendChild(root);
+  root.firstChild.onclick();
+}
+</script>
+</body></html>
+""")
+
+
+register_renderer("text", TextRenderer)
+register_renderer("markdown", MarkdownRenderer)
+register_renderer("html", HtmlRenderer)
+register_renderer("json", JsonRenderer)
+register_renderer("ndjson", NdjsonRenderer)
+register_renderer("html-lazy", LazyHtmlRenderer)
@@ -0,0 +1,181 @@
+"""
+Persistent scan index for Directory Tree Generator
+Caches directory listings in SQLite so unchanged directories are not re-listed
+"""
+
+import os
+import platform
+import sqlite3
+import threading
+import time
+
+import walker
+
+# Roots not scanned for this long are evicted, together with their listings
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+# At most this many roots are kept, least recently used ones are evicted first
+DEFAULT_MAX_ROOTS = 100
+# Pending writes are committed in batches of this size, so shard processes
+# sharing the index are not locked out for a whole scan
+COMMIT_INTERVAL = 500
+# Listings of directories modified this recently are not trusted, because a
+# change within the same mtime tick would go unnoticed
+RACY_WINDOW_NS = 2 * 10**9
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS roots (
+    path TEXT PRIMARY KEY,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS listings (
+    path TEXT PRIMARY KEY,
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    dirs BLOB NOT NULL,
+    files BLOB NOT NULL
+);
+"""
+
+
+def default_index_path():
+    """Return the index location inside the per-user cache directory"""
+    system = platform.system().lower()
+    if system == "windows":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~\\AppData\\Local")
+    elif system == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "dir_tree", "index.sqlite3")
+
+
+class ScanIndex:
+    """On-disk cache of directory listings keyed by path and validated by mtime
+
+    scan() is a drop-in replacement for walker.scan_directory: it stats the
+    directory and serves the stored listing when st_dev, st_ino and
+    st_mtime_ns are unchanged, otherwise it lists the directory and stores
+    the result.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_index_path()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+
+    def scan(self, path):
+        """List a directory, from the index when it has not changed"""
+        key = os.path.abspath(path)
+        st = os.stat(path)
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT dev, ino, mtime_ns, dirs, files FROM listings WHERE path = ?", (key,)
+                ).fetchone()
+        except UnicodeEncodeError:
+            # Undecodable file names cannot be used as keys, list them directly
+            return walker.scan_directory(path)
+
+        if row is not None and row[:3] == (st.st_dev, st.st_ino, st.st_mtime_ns):
+            self.hits += 1
+            return _decode_listing(path, row[3], row[4])
+
+        self.misses += 1
+        dirs, files = walker.scan_directory(path)
+        if time.time_ns() - st.st_mtime_ns > RACY_WINDOW_NS:
+            self._store(key, st, dirs, files, row)
+        return dirs, files
+
+    def touch_root(self, root):
+        """Mark root as used now, for eviction"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO roots (path, last_used) VALUES (?, ?)",
+                (os.path.abspath(root), time.time()),
+            )
+
+    def evict(self, max_age=DEFAULT_MAX_AGE, max_roots=DEFAULT_MAX_ROOTS):
+        """Drop roots unused for max_age seconds or beyond the max_roots most recent"""
+        with self._lock:
+            stale = self._conn.execute(
+                "SELECT path FROM roots WHERE last_used < ? "
+                "UNION SELECT path FROM roots WHERE path NOT IN "
+                "(SELECT path FROM roots ORDER BY last_used DESC LIMIT ?)",
+                (time.time() - max_age, max_roots),
+            ).fetchall()
+            for (root,) in stale:
+                # Listings shared with another root are simply re-listed the
+                # next time that root is scanned
+                self._delete_tree(root)
+                self._conn.execute("DELETE FROM roots WHERE path = ?", (root,))
+            self._conn.commit()
+        return [root for (root,) in stale]
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _store(self, key, st, dirs, files, old_row):
+        dir_blob = _encode_names(("l" if walker.is_symlink(entry) else "d") + entry.name for entry in dirs)
+        file_blob = _encode_names(entry.name for entry in files)
+        with self._lock:
+            if old_row is not None:
+                # Forget subdirectories that no longer exist
+                current = {entry.name for entry in dirs}
+                for name in _decode_names(old_row[3]):
+                    if name[1:] not in current:
+                        self._delete_tree(os.path.join(key, name[1:]))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO listings (path, dev, ino, mtime_ns, dirs, files) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, st.st_dev, st.st_ino, st.st_mtime_ns, dir_blob, file_blob),
+            )
+            self._pending += 1
+            if self._pending >= COMMIT_INTERVAL:
+                self._conn.commit()
+                self._pending = 0
+
+    def _delete_tree(self, root):
+        # Everything below root sorts between root + sep and root + the
+        # character after sep, so a range scan on the primary key finds it
+        prefix = root.rstrip(os.sep) + os.sep
+        upper = prefix[:-1] + chr(ord(os.sep) + 1)
+        self._conn.execute(
+            "DELETE FROM listings WHERE path = ? OR (path >= ? AND path < ?)",
+            (root, prefix, upper),
+        )
+
+
+def _encode_names(names):
+    return os.fsencode("\0".join(names))
+
+
+def _decode_names(blob):
+    return os.fsdecode(bytes(blob)).split("\0") if blob else []
+
+
+def _decode_listing(path, dir_blob, file_blob):
+    dirs = [
+        walker.Entry(path, name[1:], is_dir=True, is_symlink=name[0] == "l")
+        for name in _decode_names(dir_blob)
+    ]
+    files = [walker.Entry(path, name) for name in _decode_names(file_blob)]
+    return dirs, files
@@ -0,0 +1,134 @@
+"""
+Tree snapshots for Directory Tree Generator
+Saves a TreeModel to a columnar binary file and maps it back without rescanning
+"""
+
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections.abc import Sequence
+
+import tree_model
+
+MAGIC = b"DIRTREE\0"
+# Version of the file layout; files of other versions are refused
+VERSION = 2
+# Bits of the header flags
+HAS_SIZES = 1
+BIG_ENDIAN = 2
+# magic, version, flags, rows, names, name bytes, scan time
+HEADER = struct.Struct("<8sIIQQQd")
+# Columns are stored in this order, each padded to a multiple of 8 bytes;
+# the size columns only with HAS_SIZES. The name offsets follow, one more
+# than there are names, then the names themselves
+COLUMNS = (("parents", "i"), ("name_ids", "I"), ("flags", "B"), ("ends", "I"))
+SIZE_COLUMNS = (("apparent", "Q"), ("allocated", "Q"))
+ALIGNMENT = 8
+
+
+def save(model, path):
+    """Write a TreeModel to a snapshot file
+
+    The file is a header, the model's columns as raw native-endian
+    arrays, the offsets of the distinct names and the names as UTF-8. It
+    is written to a temporary file first and renamed, so readers never
+    see half a file.
+    """
+    encoded = [name.encode("utf-8", "surrogateescape") for name in model.names]
+    offsets = array("Q", [0])
+    for name in encoded:
+        offsets.append(offsets[-1] + len(name))
+    names = b"".join(encoded)
+    flags = (HAS_SIZES if model.sizes else 0) | (BIG_ENDIAN if sys.byteorder == "big" else 0)
+    scanned_at = model.scanned_at if model.scanned_at is not None else time.time()
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, flags, len(model), len(model.names), len(names), scanned_at))
+        for name, _ in COLUMNS + (SIZE_COLUMNS if model.sizes else ()):
+            # Arrays of a scan, or memoryviews of a loaded snapshot
+            _write_padded(f, getattr(model, name).tobytes())
+        _write_padded(f, offsets.tobytes())
+        f.write(names)
+    os.replace(temp_path, path)
+
+
+def load(path):
+    """Map a snapshot file and return it as a TreeModel
+
+    The columns are views of the mapped file, used in place and only
+    paged in as the tree is rendered; names are decoded as they are read,
+    so memory does not grow with the tree. ValueError is raised for files
+    that are not snapshots of this version.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < HEADER.size:
+            raise ValueError(f"{path} is not a tree snapshot")
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(data)
+    magic, version, flags, rows, name_count, name_bytes, scanned_at = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a tree snapshot")
+    if version != VERSION:
+        raise ValueError(f"{path} is a version {version} snapshot, only version {VERSION} is supported")
+    # Snapshots written on a machine of the other byte order are copied and
+    # swapped instead of used in place
+    swap = bool(flags & BIG_ENDIAN) != (sys.byteorder == "big")
+
+    model = tree_model.TreeModel(bool(flags & HAS_SIZES))
+    model.scanned_at = scanned_at
+    model._names_index = None
+    position = HEADER.size
+    try:
+        for name, typecode in COLUMNS + (SIZE_COLUMNS if model.sizes else ()):
+            column, position = _read_column(view, position, typecode, rows, swap)
+            setattr(model, name, column)
+        offsets, position = _read_column(view, position, "Q", name_count + 1, swap)
+        if offsets[0] != 0 or offsets[-1] != name_bytes or position + name_bytes > size:
+            raise ValueError
+        model.names = _Names(view[position:position + name_bytes], offsets)
+    except (ValueError, TypeError):
+        raise ValueError(f"{path} is truncated or damaged") from None
+    return model
+
+
+class _Names(Sequence):
+    """The name table of a mapped snapshot, decoding each name when it is read"""
+
+    __slots__ = ("_data", "_offsets")
+
+    def __init__(self, data, offsets):
+        self._data = data
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, name_id):
+        offsets = self._offsets
+        return str(self._data[offsets[name_id]:offsets[name_id + 1]], "utf-8", "surrogateescape")
+
+
+def _read_column(view, position, typecode, count, swap):
+    itemsize = array(typecode).itemsize
+    end = position + count * itemsize
+    if end > len(view):
+        raise ValueError
+    column = view[position:end].cast(typecode)
+    if swap:
+        column = array(typecode, column)
+        column.byteswap()
+    return column, _padded(end)
+
+
+def _write_padded(f, data):
+    f.write(data)
+    f.write(b"\0" * (_padded(len(data)) - len(data)))
+
+
+def _padded(position):
+    return -(-position // ALIGNMENT) * ALIGNMENT
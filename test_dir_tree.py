@@ -40,7 +40,7 @@ def test_tree_generation():
 
         # Test tree generation
         output_file = test_dir / "tree.txt"
-        success = dir_tree.generate_tree(str(test_dir), str(output_file), "text")
+        success = dir_tree.generate_tree(str(test_dir), str(output_file), dir_tree.TreeOptions("text"))
 
         if success and output_file.exists():
             print("✓ Tree generation successful")
@@ -56,6 +56,1007 @@ def test_tree_generation():
             print("✗ Tree generation failed")
             return False
 
+def test_output_inside_tree():
+    """Test that an output file inside the scanned directory does not list itself"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        (root / "sub").mkdir(parents=True)
+        (root / "a.txt").write_text("a")
+        (root / "sub" / "b.txt").write_text("b")
+        expected = "__root/\n    |__a.txt\n    |__sub/\n    |    |__b.txt"
+
+        for output_file, processes in ((root / "root_tree.txt", 1), (root / "sub" / "tree.txt", 2),
+                                       (root / "tree.txt.gz", 1)):
+            if not dir_tree.generate_tree(str(root), str(output_file), dir_tree.TreeOptions(processes=processes)):
+                print(f"✗ Generation into {output_file.name} failed")
+                return False
+            if output_file.suffix == ".gz":
+                import gzip
+                content = gzip.decompress(output_file.read_bytes()).decode("utf-8")
+            else:
+                content = output_file.read_text(encoding="utf-8")
+            output_file.unlink()
+            if content != expected:
+                print(f"✗ Output inside the tree lists itself: {content!r}")
+                return False
+
+        print("✓ Output files inside the tree are not listed")
+        return True
+
+def test_streamed_output_formats():
+    """Test that every format is streamed with the exact expected layout"""
+    expected = {
+        "text": "__root/\n    |__a.txt\n    |__sub/\n    |    |__b.txt",
+        "markdown": "- root/\n    |- a.txt\n    |- sub/\n    |    |- b.txt",
+        "html": ("<html><body>\n"
+                 "<div style='margin-left: 0px;'>root/</div>\n"
+                 "<div style='margin-left: 20px;'>- a.txt</div>\n"
+                 "<div style='margin-left: 20px;'>sub/</div>\n"
+                 "<div style='margin-left: 40px;'>- b.txt</div>\n"
+                 "</body></html>"),
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        (root / "sub").mkdir(parents=True)
+        (root / "a.txt").write_text("a")
+        (root / "sub" / "b.txt").write_text("b")
+
+        for format, content in expected.items():
+            output_file = Path(temp_dir) / f"tree.{format}"
+            if not dir_tree.generate_tree(str(root), str(output_file), dir_tree.TreeOptions(format)):
+                print(f"✗ {format} generation failed")
+                return False
+            if output_file.read_bytes() != content.encode("utf-8"):
+                print(f"✗ {format} output differs from expected layout")
+                return False
+        print("✓ All formats match the expected layout")
+        return True
+
+def test_json_formats():
+    """Test the streamed JSON and NDJSON renderers, serial and sharded"""
+    import json
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        (root / "sub" / "deep").mkdir(parents=True)
+        (root / "other").mkdir()
+        (root / "sub" / "b.txt").write_text("bb")
+        (root / "sub" / "deep" / "c.txt").write_text("c")
+
+        outputs = {}
+        for format in ("json", "ndjson"):
+            for processes in (1, 2):
+                output_file = Path(temp_dir) / f"tree_{processes}.{format}"
+                options = dir_tree.TreeOptions(format, sizes=True, processes=processes)
+                dir_tree.generate_tree(str(root), str(output_file), options)
+                outputs[format, processes] = output_file.read_text(encoding="utf-8")
+            if outputs[format, 1] != outputs[format, 2]:
+                print(f"✗ Sharded {format} differs from serial {format}")
+                return False
+
+        tree = json.loads(outputs["json", 1])["tree"]
+        sub = next(child for child in tree["children"] if child["name"] == "sub")
+        if tree["size"] != 3 or [child["name"] for child in sub["children"]] != ["b.txt", "deep"]:
+            print(f"✗ Unexpected JSON tree: {tree}")
+            return False
+        lines = [json.loads(line) for line in outputs["ndjson", 1].splitlines()]
+        kinds = [line["type"] for line in lines]
+        if kinds.count("directory") != 4 or kinds.count("file") != 2 or kinds.count("total") != 4:
+            print(f"✗ Unexpected NDJSON entries: {kinds}")
+            return False
+
+        print("✓ JSON and NDJSON are streamed and valid")
+        return True
+
+def test_lazy_html():
+    """Test that the lazy HTML viewer's chunks hold the whole tree"""
+    import json
+    import re
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        (root / "many").mkdir(parents=True)
+        (root / "sub" / "deep").mkdir(parents=True)
+        (root / "sub" / "deep" / "x.txt").write_text("x")
+        for i in range(2500):
+            (root / "many" / f"f{i}").write_text("")
+
+        output_file = Path(temp_dir) / "tree.html"
+        dir_tree.generate_tree(str(root), str(output_file), dir_tree.TreeOptions("html-lazy"))
+        page = output_file.read_text(encoding="utf-8")
+        chunks = {}
+        for chunk_file in (Path(temp_dir) / "tree_files").iterdir():
+            number, records = re.fullmatch(r"dirTreeChunk\((\d+),(.*)\);\n", chunk_file.read_text(), re.S).groups()
+            chunks[int(number)] = json.loads(records)
+
+        def listing(chunk, record):
+            # Follows continuation records like the viewer does
+            dirs, files = [], []
+            while True:
+                part = chunks[chunk][record]
+                dirs += part["d"]
+                files += part["f"]
+                if "m" not in part:
+                    return dirs, files
+                chunk, record = part["m"]
+
+        root_ref = json.loads(re.search(r"ROOT = (\[.*?\]),", page).group(1))
+        dirs, files = listing(*root_ref[1:3])
+        many = next(ref for ref in dirs if ref[0] == "many")
+        if len(page) > 10000 or len(listing(*many[1:3])[1]) != 2500:
+            print("✗ Unexpected lazy HTML output")
+            return False
+        sub = next(ref for ref in dirs if ref[0] == "sub")
+        deep = listing(*sub[1:3])[0][0]
+        if listing(*deep[1:3])[1] != ["x.txt"]:
+            print("✗ Nested listing not found")
+            return False
+
+        # Written inside the tree, neither the page nor its data folder is listed
+        inside = root / "root_tree.html"
+        dir_tree.generate_tree(str(root), str(inside), dir_tree.TreeOptions("html-lazy"))
+        chunks = "".join(chunk_file.read_text(encoding="utf-8")
+                         for chunk_file in (root / "root_tree_files").iterdir())
+        if "root_tree" in chunks:
+            print("✗ Lazy HTML lists its own page or data folder")
+            return False
+
+        print("✓ Lazy HTML page is small and its chunks hold the tree")
+        return True
+
+def test_compressed_output():
+    """Test that output is compressed according to the file extension"""
+    import bz2
+    import gzip
+    import lzma
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        (root / "sub").mkdir(parents=True)
+        (root / "sub" / "a.txt").write_text("a")
+        plain = Path(temp_dir) / "tree.txt"
+        dir_tree.generate_tree(str(root), str(plain), dir_tree.TreeOptions("text"))
+
+        for extension, module in ((".gz", gzip), (".bz2", bz2), (".xz", lzma)):
+            output_file = Path(temp_dir) / f"tree.txt{extension}"
+            options = dir_tree.TreeOptions("text", compress_level=1)
+            if not dir_tree.generate_tree(str(root), str(output_file), options):
+                print(f"✗ {extension} output failed")
+                return False
+            with module.open(output_file) as f:
+                if f.read() != plain.read_bytes():
+                    print(f"✗ {extension} output differs after decompression")
+                    return False
+        if dir_tree.generate_tree(str(root), str(Path(temp_dir) / "tree.txt.gz"),
+                                  dir_tree.TreeOptions("text", compress_level=99)):
+            print("✗ Invalid compression level accepted")
+            return False
+
+        print("✓ Output is compressed by extension")
+        return True
+
+def test_stdout_output():
+    """Test -o - streaming and a cleanly handled closed pipe"""
+    import subprocess
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        root.mkdir()
+        for i in range(20):
+            (root / f"dir{i}").mkdir()
+            for j in range(500):
+                (root / f"dir{i}" / f"file_with_a_long_name_{j}.txt").write_text("")
+        output_file = Path(temp_dir) / "tree.txt"
+        dir_tree.generate_tree(str(root), str(output_file), dir_tree.TreeOptions("text"))
+
+        command = [sys.executable, os.path.abspath(dir_tree.__file__), str(root), "-o", "-"]
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0 or result.stdout.replace(b"\r\n", b"\n") != output_file.read_bytes():
+            print(f"✗ Unexpected stdout output: {result.stderr}")
+            return False
+
+        # The reader stops after the first line, like head -1
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        process.stdout.readline()
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.wait()
+        if b"Traceback" in stderr or b"Error" in stderr:
+            print(f"✗ Closed pipe was not handled cleanly: {stderr}")
+            return False
+
+        print("✓ Tree is streamed to stdout")
+        return True
+
+def test_walker_depth():
+    """Test that walker depth does not depend on the path text"""
+    import walker
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # The start path reappears deeper in the tree, which confused the
+        # old string-replace depth calculation
+        (Path(temp_dir) / "x" / "y" / "c" / "x" / "y" / "d").mkdir(parents=True)
+        cwd = os.getcwd()
+        os.chdir(temp_dir)
+        try:
+            depths = {path: depth for path, depth, dirs, files in walker.walk(os.path.join("x", "y"))}
+        finally:
+            os.chdir(cwd)
+
+        deepest = os.path.join("x", "y", "c", "x", "y", "d")
+        if depths.get(deepest) == 4 and len(depths) == 5:
+            print("✓ Walker depth is correct")
+            return True
+        print(f"✗ Unexpected walker depths: {depths}")
+        return False
+
+def test_parallel_walk_order():
+    """Test that threaded listing and sharded rendering keep the serial output"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        for i in range(5):
+            for j in range(3):
+                sub = root / f"dir{i}" / f"sub{j}"
+                sub.mkdir(parents=True)
+                for k in range(4):
+                    (sub / f"file{k}.txt").write_text("x")
+
+        serial = Path(temp_dir) / "serial.txt"
+        parallel = Path(temp_dir) / "parallel.txt"
+        dir_tree.generate_tree(str(root), str(serial), dir_tree.TreeOptions("text"))
+        dir_tree.generate_tree(str(root), str(parallel), dir_tree.TreeOptions("text", workers=4))
+        if serial.read_bytes() != parallel.read_bytes():
+            print("✗ Parallel output differs from serial output")
+            return False
+
+        for format in ("text", "markdown", "html"):
+            serial = Path(temp_dir) / f"serial.{format}"
+            sharded = Path(temp_dir) / f"sharded.{format}"
+            dir_tree.generate_tree(str(root), str(serial), dir_tree.TreeOptions(format))
+            dir_tree.generate_tree(str(root), str(sharded), dir_tree.TreeOptions(format, processes=2))
+            if serial.read_bytes() != sharded.read_bytes():
+                print(f"✗ Sharded {format} output differs from serial output")
+                return False
+
+        print("✓ Parallel output matches serial output")
+        return True
+
+def test_scan_index():
+    """Test that the scan index serves unchanged directories and notices changes"""
+    import scan_index
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        (root / "a").mkdir(parents=True)
+        (root / "b").mkdir()
+        (root / "a" / "one.txt").write_text("1")
+
+        def age(*dirs):
+            # Recently modified listings are not trusted, so backdate them
+            for i, directory in enumerate(dirs):
+                os.utime(directory, (1000000000 + i, 1000000000 + i))
+
+        age(root, root / "a", root / "b")
+        output_file = Path(temp_dir) / "tree.txt"
+        with scan_index.ScanIndex(str(Path(temp_dir) / "index.sqlite3")) as index:
+            dir_tree.generate_tree(str(root), str(output_file), dir_tree.TreeOptions("text"), index)
+            first = output_file.read_bytes()
+            dir_tree.generate_tree(str(root), str(output_file), dir_tree.TreeOptions("text"), index)
+            if index.hits != 3 or output_file.read_bytes() != first:
+                print(f"✗ Unchanged tree was not served from the index ({index.hits} hits)")
+                return False
+
+            (root / "b" / "two.txt").write_text("2")
+            age(root / "b")
+            dir_tree.generate_tree(str(root), str(output_file), dir_tree.TreeOptions("text"), index)
+            if index.misses != 4 or "two.txt" not in output_file.read_text():
+                print("✗ Changed directory was not re-listed")
+                return False
+
+            if index.evict(max_roots=0) != [str(root)]:
+                print("✗ Root was not evicted")
+                return False
+
+        print("✓ Scan index reuses unchanged listings")
+        return True
+
+def test_watch_mode():
+    """Test that the watched tree follows changes like a fresh scan"""
+    if dir_tree.CURRENT_OS != "linux":
+        print("✓ Watch mode is Linux only, skipped")
+        return True
+    import time
+    import watcher
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        (root / "a").mkdir(parents=True)
+        (root / "a" / "old.txt").write_text("x")
+        watched = Path(temp_dir) / "watched.txt"
+        scanned = Path(temp_dir) / "scanned.txt"
+
+        tree = watcher.TreeWatcher(str(root))
+        try:
+            tree.scan()
+            (root / "b" / "c").mkdir(parents=True)
+            (root / "b" / "c" / "new.txt").write_text("x")
+            (root / "a" / "old.txt").unlink()
+            deadline = time.monotonic() + 0.5
+            while time.monotonic() < deadline:
+                tree.read_events(0.1)
+            dir_tree.write_tree(tree.entries(), str(watched), dir_tree.TreeOptions("text"))
+        finally:
+            tree.close()
+
+        dir_tree.generate_tree(str(root), str(scanned), dir_tree.TreeOptions("text"))
+        if watched.read_bytes() != scanned.read_bytes() or "new.txt" not in watched.read_text():
+            print("✗ Watched tree differs from a fresh scan")
+            return False
+
+        # html-lazy's data folder cannot be replaced along with its page
+        import subprocess
+        command = [sys.executable, os.path.abspath(dir_tree.__file__), str(root), "--watch", "-f", "html-lazy"]
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30)
+        if result.returncode != 1 or b"--watch cannot rewrite html-lazy" not in result.stdout:
+            print(f"✗ html-lazy was not rejected in --watch mode: {result.stdout}")
+            return False
+
+        # --sizes and --top apply to the watched tree too
+        sized = Path(temp_dir) / "sized.txt"
+        process = subprocess.Popen(command[:3] + ["--watch", "--sizes", "--top", "1", "-o", str(sized)],
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.monotonic() + 10
+            while not sized.exists() and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            process.terminate()
+            process.wait()
+        if not sized.exists() or "Largest 1 files" not in sized.read_text(encoding="utf-8"):
+            print("✗ --sizes and --top were dropped in --watch mode")
+            return False
+
+        print("✓ Watched tree matches a fresh scan")
+        return True
+
+def test_tree_filter():
+    """Test depth limits, globs and .gitignore rules, and that pruned directories are never listed"""
+    import walker
+    from tree_filter import TreeFilter
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        for directory in ("src/app", "node_modules/pkg", ".git", "build/out", "docs/deep"):
+            (root / directory).mkdir(parents=True)
+        for file in ("src/app/main.py", "src/app/main.pyc", "node_modules/pkg/index.js",
+                     "build/out/a.o", "docs/keep.log", "docs/deep/x.md", "top.log"):
+            (root / file).write_text("x")
+        (root / ".gitignore").write_text("build/\n*.log\n!docs/*.log\n")
+        (root / "src" / ".gitignore").write_text("*.pyc\n")
+
+        listed = []
+
+        def scan(path):
+            listed.append(os.path.relpath(path, root))
+            return walker.scan_directory(path)
+
+        tree_filter = TreeFilter(exclude=["node_modules"], use_gitignore=True)
+        shown = set()
+        for path, depth, dirs, files in walker.walk(str(root), scan=scan, tree_filter=tree_filter):
+            shown.update(os.path.relpath(entry.path, root) for entry in files)
+        expected = {".gitignore", os.path.join("src", ".gitignore"), os.path.join("src", "app", "main.py"),
+                    os.path.join("docs", "keep.log"), os.path.join("docs", "deep", "x.md")}
+        if shown != expected:
+            print(f"✗ Unexpected files after filtering: {sorted(shown)}")
+            return False
+        if any(path.split(os.sep)[0] in ("node_modules", ".git", "build") for path in listed):
+            print(f"✗ Pruned directories were listed: {listed}")
+            return False
+
+        listed.clear()
+        tree_filter = TreeFilter(max_depth=1, include=["*.md"])
+        for path, depth, dirs, files in walker.walk(str(root), scan=scan, tree_filter=tree_filter):
+            if files:
+                print("✗ --include or --max-depth let files through")
+                return False
+        if listed != ["."]:
+            print(f"✗ Directories below the depth limit were listed: {listed}")
+            return False
+
+        print("✓ Filtered entries are pruned before listing")
+        return True
+
+def test_directory_sizes():
+    """Test that file sizes roll up into directory totals, also across shards"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        (root / "a" / "b").mkdir(parents=True)
+        (root / "c").mkdir()
+        (root / "one.bin").write_bytes(b"x" * 100)
+        (root / "a" / "two.bin").write_bytes(b"x" * 200)
+        (root / "a" / "b" / "three.bin").write_bytes(b"x" * 300)
+        (root / "c" / "four.bin").write_bytes(b"x" * 400)
+
+        serial = Path(temp_dir) / "serial.txt"
+        sharded = Path(temp_dir) / "sharded.txt"
+        dir_tree.generate_tree(str(root), str(serial), dir_tree.TreeOptions("text", sizes=True))
+        dir_tree.generate_tree(str(root), str(sharded), dir_tree.TreeOptions("text", sizes=True, processes=2))
+        lines = serial.read_text(encoding="utf-8").splitlines()
+
+        if "    |__one.bin (100 B," not in "\n".join(lines):
+            print("✗ File size missing")
+            return False
+        if not lines[-1].startswith("    |== root/ total: 1000 B,"):
+            print(f"✗ Unexpected root total: {lines[-1]}")
+            return False
+        if "    |    |== a/ total: 500 B," not in "\n".join(lines):
+            print("✗ Subdirectory total missing")
+            return False
+        if serial.read_bytes() != sharded.read_bytes():
+            print("✗ Sharded sizes differ from serial sizes")
+            return False
+
+        print("✓ Sizes are rolled up into directory totals")
+        return True
+
+def test_largest_entries():
+    """Test the top-N summary of largest files and directories"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        (root / "big").mkdir(parents=True)
+        (root / "small").mkdir()
+        for i, size in enumerate((10, 5000, 300, 7000)):
+            (root / ("big" if size > 1000 else "small") / f"file{i}.bin").write_bytes(b"x" * size)
+
+        output_file = Path(temp_dir) / "tree.txt"
+        dir_tree.generate_tree(str(root), str(output_file), dir_tree.TreeOptions("text", top=2))
+        summary = output_file.read_text(encoding="utf-8").split("Largest 2 files:")[-1]
+        expected = [
+            f"    1. {root / 'big' / 'file3.bin'} (6.8 KiB,",
+            f"    2. {root / 'big' / 'file1.bin'} (4.9 KiB,",
+            "Largest 2 directories:",
+            f"    1. {root} (12.0 KiB,",
+            f"    2. {root / 'big'} (11.7 KiB,",
+        ]
+        lines = [line for line in summary.splitlines() if line]
+        if len(lines) != len(expected) or not all(line.startswith(e) for line, e in zip(lines, expected)):
+            print(f"✗ Unexpected summary: {lines}")
+            return False
+
+        # Paths are text in the HTML summary, not markup
+        (root / "small" / "<b>&.bin").write_bytes(b"x" * 9000)
+        html_file = Path(temp_dir) / "tree.html"
+        dir_tree.generate_tree(str(root), str(html_file), dir_tree.TreeOptions("html", top=1))
+        summary = html_file.read_text(encoding="utf-8").split("Largest 1 files")[-1]
+        if "&lt;b&gt;&amp;.bin" not in summary or "<b>&" in summary:
+            print("✗ Paths are not escaped in the HTML summary")
+            return False
+
+        print("✓ Largest entries are summarized")
+        return True
+
+def test_symlink_loops_and_hardlinks():
+    """Test that followed symlink loops are cut and hardlinks are counted once"""
+    import walker
+    if not hasattr(os, "symlink") or dir_tree.CURRENT_OS == "windows":
+        print("✓ Skipped, symlinks need privileges on this platform")
+        return True
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        (root / "a" / "b").mkdir(parents=True)
+        (root / "release").mkdir()
+        (root / "a" / "b" / "loop").symlink_to(root, target_is_directory=True)
+        (root / "current").symlink_to(root / "release", target_is_directory=True)
+        (root / "release" / "data.bin").write_bytes(b"x" * 100)
+        os.link(root / "release" / "data.bin", root / "release" / "copy.bin")
+
+        paths = [path for path, depth, dirs, files in walker.walk(str(root), follow_symlinks=True)]
+        real_paths = {os.path.realpath(path) for path in paths}
+        if len(paths) != 4 or len(real_paths) != 4:
+            print(f"✗ Unexpected followed walk: {paths}")
+            return False
+
+        serial = Path(temp_dir) / "serial.txt"
+        sharded = Path(temp_dir) / "sharded.txt"
+        for output_file, processes in ((serial, 1), (sharded, 2)):
+            options = dir_tree.TreeOptions("text", sizes=True, processes=processes, follow_symlinks=True,
+                                           count_hardlinks_once=True)
+            dir_tree.generate_tree(str(root), str(output_file), options)
+        lines = serial.read_text(encoding="utf-8").splitlines()
+        if not lines[-1].startswith("    |== root/ total: 100 B,"):
+            print(f"✗ Hardlink counted twice: {lines[-1]}")
+            return False
+        if serial.read_bytes() != sharded.read_bytes():
+            print("✗ Sharded walk differs from serial walk")
+            return False
+
+        print("✓ Symlink loops are cut and hardlinks are counted once")
+        return True
+
+def test_tree_model():
+    """Test that the array-backed tree model renders like a direct scan"""
+    import tree_model
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        (root / "a" / "b").mkdir(parents=True)
+        (root / "c").mkdir()
+        (root / "one.bin").write_bytes(b"x" * 100)
+        (root / "a" / "two.bin").write_bytes(b"x" * 200)
+        (root / "c" / "two.bin").write_bytes(b"x" * 300)
+
+        model = tree_model.scan_tree(str(root), sizes=True)
+        if len(model) != 7 or len(model.names) != 6 or model.usage(0)[0] != 600:
+            print(f"✗ Unexpected model: {len(model)} rows, {model.names}, {model.usage(0)}")
+            return False
+        children = sorted(model.path(row) for row in model.children(0))
+        if children != sorted(str(root / name) for name in ("a", "c", "one.bin")):
+            print(f"✗ Unexpected children: {children}")
+            return False
+
+        for format in ("text", "html", "json"):
+            from_model = Path(temp_dir) / f"model.{format}"
+            direct = Path(temp_dir) / f"direct.{format}"
+            dir_tree.write_tree(model.entries(), str(from_model), dir_tree.TreeOptions(format, sizes=True))
+            dir_tree.generate_tree(str(root), str(direct), dir_tree.TreeOptions(format, sizes=True))
+            if from_model.read_bytes() != direct.read_bytes():
+                print(f"✗ {format} rendered from the model differs")
+                return False
+
+        print(f"✓ Model renders like a direct scan ({model.memory_usage() // len(model)} bytes per entry)")
+        return True
+
+def test_snapshot():
+    """Test saving a tree snapshot while generating and rendering from it"""
+    import snapshot
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        (root / "a" / "b").mkdir(parents=True)
+        (root / "one.bin").write_bytes(b"x" * 100)
+        (root / "a" / "caf\u00e9.txt").write_bytes(b"x" * 200)
+        snapshot_file = str(Path(temp_dir) / "root.dtsnap")
+
+        direct = Path(temp_dir) / "direct.txt"
+        if not dir_tree.generate_tree(str(root), str(direct), dir_tree.TreeOptions(sizes=True, processes=2),
+                                      snapshot_file=snapshot_file):
+            print("✗ Generation with a snapshot failed")
+            return False
+        model = snapshot.load(snapshot_file)
+        if len(model) != 5 or not model.sizes or model.usage(0)[0] != 300:
+            print(f"✗ Unexpected snapshot: {len(model)} rows, {model.names}")
+            return False
+
+        for format in ("text", "markdown", "json"):
+            from_snapshot = Path(temp_dir) / f"snapshot.{format}"
+            expected = Path(temp_dir) / f"expected.{format}"
+            dir_tree.render_snapshot(snapshot_file, str(from_snapshot), dir_tree.TreeOptions(format, sizes=True))
+            dir_tree.generate_tree(str(root), str(expected), dir_tree.TreeOptions(format, sizes=True))
+            if from_snapshot.read_bytes() != expected.read_bytes():
+                print(f"✗ {format} rendered from the snapshot differs")
+                return False
+
+        # A loaded snapshot saves to the same bytes
+        copy = str(Path(temp_dir) / "copy.dtsnap")
+        snapshot.save(model, copy)
+        if Path(copy).read_bytes() != Path(snapshot_file).read_bytes():
+            print("✗ Snapshot changed when saved again")
+            return False
+
+        Path(copy).write_bytes(Path(snapshot_file).read_bytes()[:-20])
+        try:
+            snapshot.load(copy)
+            print("✗ Truncated snapshot loaded")
+            return False
+        except ValueError:
+            pass
+        if dir_tree.render_snapshot(str(direct), str(Path(temp_dir) / "x.txt")):
+            print("✗ A text file was rendered as a snapshot")
+            return False
+
+        # A start directory that cannot be listed gives a model without rows
+        import tree_diff
+        import tree_model
+        empty = str(Path(temp_dir) / "empty.dtsnap")
+        snapshot.save(tree_model.scan_tree(str(root / "missing")), empty)
+        try:
+            empty_model = snapshot.load(empty)
+            changes = list(tree_diff.diff_trees(tree_diff.SnapshotTree(empty_model), tree_diff.SnapshotTree(model)))
+        except (ValueError, IndexError) as e:
+            print(f"✗ Empty snapshot not read back: {e}")
+            return False
+        if len(empty_model) or len(empty_model.names) or \
+                changes != [(tree_diff.ADDED, "a", True, None, None), (tree_diff.ADDED, "one.bin", False, None, 100)]:
+            print(f"✗ Unexpected empty snapshot: {len(empty_model)} rows, {changes}")
+            return False
+
+        print("✓ Snapshots render like a direct scan")
+        return True
+
+def test_tree_diff():
+    """Test the streaming diff of snapshots and directories"""
+    import io
+    import json
+    import tree_diff
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        for path in ("a/b", "gone/deep", "same"):
+            (root / path).mkdir(parents=True)
+        (root / "a" / "grows.txt").write_text("x")
+        (root / "a" / "b" / "kept.txt").write_text("kept")
+        (root / "kind").write_text("file")
+        old_snapshot = str(Path(temp_dir) / "old.dtsnap")
+        dir_tree.generate_tree(str(root), str(Path(temp_dir) / "old.txt"), dir_tree.TreeOptions(sizes=True),
+                               snapshot_file=old_snapshot)
+
+        (root / "a" / "grows.txt").write_text("xxx")
+        (root / "a" / "b" / "new.txt").write_text("new")
+        shutil.rmtree(root / "gone")
+        (root / "kind").unlink()
+        (root / "kind").mkdir()
+        expected = [
+            (tree_diff.REMOVED, "gone", True, None, None),
+            (tree_diff.REMOVED, "kind", False, 4, None),
+            (tree_diff.ADDED, "kind", True, None, None),
+            (tree_diff.CHANGED, os.path.join("a", "grows.txt"), False, 1, 3),
+            (tree_diff.ADDED, os.path.join("a", "b", "new.txt"), False, None, 3),
+        ]
+        old = tree_diff.open_tree(old_snapshot)
+        changes = list(tree_diff.diff_trees(old, tree_diff.open_tree(str(root))))
+        if changes != expected:
+            print(f"✗ Unexpected changes against the directory: {changes}")
+            return False
+
+        new_snapshot = str(Path(temp_dir) / "new.dtsnap")
+        dir_tree.generate_tree(str(root), str(Path(temp_dir) / "new.txt"), dir_tree.TreeOptions(sizes=True),
+                               snapshot_file=new_snapshot)
+        changes = list(tree_diff.diff_trees(old, tree_diff.open_tree(new_snapshot)))
+        if changes != expected:
+            print(f"✗ Unexpected changes between snapshots: {changes}")
+            return False
+        if list(tree_diff.diff_trees(old, old)):
+            print("✗ A snapshot differs from itself")
+            return False
+
+        output = io.StringIO()
+        counts = tree_diff.write_diff(iter(expected), output)
+        lines = output.getvalue().splitlines()
+        if counts[tree_diff.ADDED] != 2 or lines[0] != f"- gone{os.sep}" or \
+                lines[-1] != "2 added, 2 removed, 1 changed":
+            print(f"✗ Unexpected text diff: {lines}")
+            return False
+        output = io.StringIO()
+        tree_diff.write_diff(iter(expected), output, "ndjson")
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        if len(records) != 5 or records[3] != {"change": "changed", "path": os.path.join("a", "grows.txt"),
+                                               "type": "file", "old_size": 1, "new_size": 3}:
+            print(f"✗ Unexpected NDJSON diff: {records}")
+            return False
+
+        print("✓ Added, removed and changed entries found between snapshots and directories")
+        return True
+
+def test_progress_and_cancel():
+    """Test progress reporting and cancellation of generate_tree"""
+    import threading
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        for i in range(10):
+            (root / f"dir{i}").mkdir(parents=True)
+            (root / f"dir{i}" / "a.txt").write_text("a")
+        output_file = Path(temp_dir) / "tree.txt"
+
+        reports = []
+        dir_tree.generate_tree(str(root), str(output_file), dir_tree.TreeOptions("text"),
+                               progress=lambda entries, path: reports.append(entries))
+        if reports[-1] != 21 or reports != sorted(reports):
+            print(f"✗ Unexpected progress reports: {reports}")
+            return False
+
+        cancel = threading.Event()
+
+        def cancel_after_three(entries, path):
+            if entries >= 3:
+                cancel.set()
+
+        for processes in (1, 2):
+            options = dir_tree.TreeOptions("text", processes=processes)
+            if dir_tree.generate_tree(str(root), str(output_file), options, progress=cancel_after_three,
+                                      cancel=cancel):
+                print("✗ Cancelled generation reported success")
+                return False
+            if output_file.exists():
+                print("✗ Partial output was left behind")
+                return False
+            cancel.clear()
+
+        print("✓ Progress is reported and generation can be cancelled")
+        return True
+
+def test_run_stats():
+    """Test the --progress counters and timing summary"""
+    import io
+    import progress
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        for i in range(4):
+            (root / f"dir{i}").mkdir(parents=True)
+            (root / f"dir{i}" / "a.txt").write_text("a")
+        (root / "b.txt").write_text("b")
+
+        for processes, name in ((1, "tree.txt"), (2, "tree.txt"), (1, "tree.txt.gz")):
+            output_file = Path(temp_dir) / name
+            report = io.StringIO()
+            stats = progress.RunStats(report, interval=0)
+            options = dir_tree.TreeOptions("text", processes=processes)
+            if not dir_tree.generate_tree(str(root), str(output_file), options, stats=stats):
+                print("✗ Generation with stats failed")
+                return False
+            if (stats.directories, stats.files) != (5, 5):
+                print(f"✗ Unexpected counts: {stats.directories} directories, {stats.files} files")
+                return False
+            plain = (Path(temp_dir) / "tree.txt").read_bytes() if name == "tree.txt" else None
+            if plain is not None and stats.bytes_written != len(plain):
+                print(f"✗ {stats.bytes_written} bytes counted, {len(plain)} written")
+                return False
+            report = report.getvalue()
+            if "Scanned 5 directories and 5 files" not in report or "Time: walk" not in report:
+                print(f"✗ Unexpected summary: {report!r}")
+                return False
+            total = stats.walk_time + stats.render_time + stats.write_time
+            if abs(total - stats.elapsed) > 1e-6 or stats.finished is None:
+                print("✗ Phase times do not add up to the elapsed time")
+                return False
+
+        print("✓ Progress counters and timing summary")
+        return True
+
+def test_batch():
+    """Test generating several trees with shared pools and a manifest"""
+    import io
+    with tempfile.TemporaryDirectory() as temp_dir:
+        roots = []
+        for name in ("one", "two"):
+            root = Path(temp_dir) / name / "src"
+            (root / "sub").mkdir(parents=True)
+            (root / "sub" / f"{name}.txt").write_text(name)
+            roots.append(str(root))
+        manifest = Path(temp_dir) / "manifest.txt"
+        manifest.write_text(f"# projects\n{roots[0]}\n\n  {roots[1]}  \n")
+        if dir_tree.read_manifest(str(manifest)) != roots:
+            print(f"✗ Unexpected manifest: {dir_tree.read_manifest(str(manifest))}")
+            return False
+
+        output_dir = Path(temp_dir) / "out"
+        output_dir.mkdir()
+        jobs = []
+        for root in roots:
+            taken = {output_file for _, output_file in jobs}
+            jobs.append((root, dir_tree._output_path(root, "txt", "20250101_000000", str(output_dir), taken)))
+        if [os.path.basename(output_file) for _, output_file in jobs] != \
+                ["src_tree_20250101_000000.txt", "src_tree_20250101_000000_2.txt"]:
+            print(f"✗ Output names of same-named directories collide: {jobs}")
+            return False
+
+        for workers, processes in ((1, 1), (4, 1), (2, 2)):
+            options = dir_tree.TreeOptions("text", workers=workers, processes=processes)
+            results = list(dir_tree.generate_trees(jobs, options, io.StringIO()))
+            if [success for _, _, success, _ in results] != [True, True]:
+                print(f"✗ Batch generation failed with {workers} workers, {processes} processes")
+                return False
+            if [(stats.directories, stats.files) for _, _, _, stats in results] != [(2, 1), (2, 1)]:
+                print("✗ Unexpected per-tree counts")
+                return False
+            for root, output_file in jobs:
+                content = Path(output_file).read_text(encoding="utf-8")
+                expected = Path(root).parent.name + ".txt"
+                if expected not in content or "|__sub/" not in content:
+                    print(f"✗ Unexpected tree for {root}: {content!r}")
+                    return False
+
+        print("✓ Several trees generated in one run")
+        return True
+
+def test_profile():
+    """Test the --profile pstats and JSON summary"""
+    import io
+    import json
+    import pstats
+    import profiling
+    import progress
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        for i in range(3):
+            (root / f"dir{i}").mkdir(parents=True)
+            (root / f"dir{i}" / "a.txt").write_text("a")
+        output_file = Path(temp_dir) / "tree.txt"
+        profile_file = str(Path(temp_dir) / "run.prof")
+
+        stats = progress.RunStats(io.StringIO())
+        options = dir_tree.TreeOptions("text", sizes=True, workers=2)
+        if not profiling.profile_call(profile_file, stats, dir_tree.generate_tree, str(root),
+                                      str(output_file), options, stats=stats):
+            print("✗ Profiled generation failed")
+            return False
+        with open(profile_file + ".json", encoding="utf-8") as f:
+            summary = json.load(f)
+        operations = summary["operations"]
+        # Listings happen in the walker's threads, which are profiled too
+        if operations["listings"] != 4 or operations["entry_stat"] != 3:
+            print(f"✗ Unexpected operation counts: {operations}")
+            return False
+        if summary["counts"]["files"] != 3 or set(summary["phases"]) != {"walk", "render", "write"}:
+            print(f"✗ Unexpected summary: {summary}")
+            return False
+        if not pstats.Stats(profile_file).total_calls:
+            print("✗ The pstats file is empty")
+            return False
+
+        print("✓ Profile and summary written")
+        return True
+
+def test_headless_imports():
+    """Test that generating a tree does not import the GUI, updater or multiprocessing"""
+    import subprocess
+    import benchmark
+    with tempfile.TemporaryDirectory() as temp_dir:
+        (Path(temp_dir) / "root" / "sub").mkdir(parents=True)
+        script = (
+            "import sys, dir_tree\n"
+            f"dir_tree.generate_tree({str(Path(temp_dir) / 'root')!r}, {str(Path(temp_dir) / 'tree.txt')!r})\n"
+            f"print(' '.join(m for m in {benchmark.HEADLESS_EXCLUDED!r} if m in sys.modules))\n"
+        )
+        completed = subprocess.run([sys.executable, "-c", script], stdout=subprocess.PIPE,
+                                   universal_newlines=True, cwd=os.path.dirname(os.path.abspath(dir_tree.__file__)))
+        if completed.returncode != 0 or completed.stdout.strip():
+            print(f"✗ Headless generation imported: {completed.stdout.strip() or 'failed'}")
+            return False
+
+    print("✓ Headless generation imports no GUI, updater or multiprocessing modules")
+    return True
+
+def test_benchmark():
+    """Test the synthetic trees and result comparison of the benchmark harness"""
+    import benchmark
+    import walker
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for shape, expected in (("wide", (3, 2000)), ("deep", (6, 2000))):
+            root = os.path.join(temp_dir, shape)
+            if benchmark.make_tree(root, shape, 2000, depth=5) != expected:
+                print(f"✗ Unexpected {shape} tree size")
+                return False
+            entries = list(walker.walk(root))
+            if (len(entries), sum(len(files) for _, _, _, files in entries)) != expected:
+                print(f"✗ The {shape} tree on disk does not match its reported size")
+                return False
+
+        listings = []
+        for run in range(2):
+            root = os.path.join(temp_dir, f"mixed{run}")
+            benchmark.make_tree(root, "mixed", 500, seed=7)
+            listings.append([(os.path.relpath(path, root), sorted(entry.name for entry in files))
+                             for path, _, _, files in walker.walk(root)])
+        if listings[0] != listings[1]:
+            print("✗ The mixed tree is not reproducible")
+            return False
+
+    def results(seconds):
+        return {"parameters": {"files": 1}, "results": [
+            {"shape": "wide", "format": "text", "mode": "serial", "median": seconds}]}
+
+    lines, regressions = benchmark.compare(results(1.0), results(1.05))
+    if regressions:
+        print("✗ A 5% slowdown was reported as a regression")
+        return False
+    lines, regressions = benchmark.compare(results(1.0), results(1.5))
+    if regressions != [("wide", "text", "serial")] or "REGRESSION" not in lines[-1]:
+        print(f"✗ A 50% slowdown was not reported: {lines}")
+        return False
+
+    print("✓ Benchmark trees are reproducible and regressions are detected")
+    return True
+
+def test_tree_server():
+    """Test serving trees from the scan cache over a Unix socket"""
+    import io
+    import socket
+    import threading
+    import tree_server
+    if not hasattr(socket, "AF_UNIX"):
+        print("✓ Skipped, Unix domain sockets not available")
+        return True
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / "root"
+        (root / "sub").mkdir(parents=True)
+        (root / "sub" / "a.txt").write_text("a")
+        socket_path = os.path.join(temp_dir, "tree.sock")
+        server = tree_server.TreeServer(socket_path, dir_tree.write_tree, cache=tree_server.ScanCache(capacity=2))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            output_file = Path(temp_dir) / "tree.txt"
+            answers = [tree_server.request_tree(str(root), str(output_file), socket_path=socket_path)
+                       for _ in range(2)]
+            # Counts of a cached scan are the ones taken when it was scanned
+            counts = [(answer["cached"], answer["directories"], answer["files"]) for answer in answers]
+            if counts != [(False, 2, 1), (True, 2, 1)]:
+                print(f"✗ Unexpected answers: {answers}")
+                return False
+            expected = Path(temp_dir) / "expected.txt"
+            dir_tree.generate_tree(str(root), str(expected))
+            if output_file.read_text(encoding="utf-8") != expected.read_text(encoding="utf-8"):
+                print("✗ Served tree differs from a locally generated one")
+                return False
+
+            (root / "sub" / "b.txt").write_text("b")
+            # So the change shows on filesystems with coarse timestamps
+            os.utime(root / "sub", ns=(0, 0))
+            stream = io.BytesIO()
+            answer = tree_server.request_tree(str(root), "-", dir_tree.TreeOptions("json"), socket_path, stream)
+            if answer["cached"] or b'"b.txt"' not in stream.getvalue():
+                print("✗ Changed directory served from the cache")
+                return False
+
+            # Trees written to the default location, inside the scanned
+            # directory, must not invalidate the scan
+            answers = []
+            for timestamp in ("20260101_000001", "20260101_000002", "20260101_000003"):
+                output_file = dir_tree._output_path(str(root), "html", timestamp)
+                answers.append(tree_server.request_tree(str(root), output_file, dir_tree.TreeOptions("html-lazy"),
+                                                        socket_path))
+            counts = [(answer["cached"], answer["files"]) for answer in answers]
+            if counts != [(True, 2), (True, 2), (True, 2)]:
+                print(f"✗ Own output invalidated the cached scan: {counts}")
+                return False
+
+            try:
+                tree_server.request_tree(str(root / "missing"), "-", socket_path=socket_path,
+                                         stream=io.BytesIO())
+                print("✗ Missing directory not reported")
+                return False
+            except tree_server.ServerError:
+                pass
+        finally:
+            server.shutdown()
+            server.server_close()
+        if os.path.exists(socket_path):
+            print("✗ Socket left behind")
+            return False
+
+    print("✓ Trees served from the cache and rescanned after changes")
+    return True
+
+def test_listing_cache():
+    """Test the LRU listing cache behind the tree preview"""
+    try:
+        import tree_preview
+    except ImportError as e:
+        print(f"✓ Skipped, tkinter not available: {e}")
+        return True
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir)
+        for name in ("a", "b", "c"):
+            (root / name).mkdir()
+        (root / "B.txt").write_text("")
+        (root / "a.txt").write_text("")
+
+        cache = tree_preview.ListingCache(capacity=2)
+        if cache.listing(str(root)) != (["a", "b", "c"], ["a.txt", "B.txt"]):
+            print(f"✗ Unexpected listing: {cache.listing(str(root))}")
+            return False
+        cache.listing(str(root / "a"))
+        cache.listing(str(root))
+        cache.listing(str(root / "b"))
+        # The root was used more recently than a, so a was evicted
+        cache.listing(str(root))
+        cache.listing(str(root / "a"))
+        if (cache.hits, cache.misses) != (2, 4):
+            print(f"✗ Unexpected cache use: {cache.hits} hits, {cache.misses} misses")
+            return False
+
+        os.utime(root, ns=(0, 0))
+        (root / "d").mkdir()
+        if "d" not in cache.listing(str(root))[0]:
+            print("✗ Changed directory served from the cache")
+            return False
+
+        print("✓ Listings are cached and revalidated")
+        return True
+
 def test_context_menu_functions():
     """Test that context menu functions exist and don't crash"""
     try:
@@ -81,6 +1082,31 @@ def main():
     tests = [
         ("OS Detection", test_os_detection),
         ("Tree Generation", test_tree_generation),
+        ("Output Inside Tree", test_output_inside_tree),
+        ("Streamed Output Formats", test_streamed_output_formats),
+        ("JSON Formats", test_json_formats),
+        ("Lazy HTML", test_lazy_html),
+        ("Compressed Output", test_compressed_output),
+        ("Stdout Output", test_stdout_output),
+        ("Walker Depth", test_walker_depth),
+        ("Parallel Walk Order", test_parallel_walk_order),
+        ("Scan Index", test_scan_index),
+        ("Watch Mode", test_watch_mode),
+        ("Tree Filter", test_tree_filter),
+        ("Directory Sizes", test_directory_sizes),
+        ("Largest Entries", test_largest_entries),
+        ("Symlinks and Hardlinks", test_symlink_loops_and_hardlinks),
+        ("Tree Model", test_tree_model),
+        ("Snapshot", test_snapshot),
+        ("Tree Diff", test_tree_diff),
+        ("Progress and Cancel", test_progress_and_cancel),
+        ("Run Stats", test_run_stats),
+        ("Batch", test_batch),
+        ("Profile", test_profile),
+        ("Headless Imports", test_headless_imports),
+        ("Benchmark", test_benchmark),
+        ("Tree Server", test_tree_server),
+        ("Listing Cache", test_listing_cache),
         ("Context Menu Functions", test_context_menu_functions),
     ]
 
@@ -0,0 +1,247 @@
+"""
+Tree diff for Directory Tree Generator
+Compares two trees, each a saved snapshot or a live directory, one directory at a time
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import compression
+import disk_usage
+import tree_model
+import walker
+from tree_filter import TreeFilter
+
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+FORMATS = ("text", "ndjson")
+# Marks of each kind of change in text output
+TEXT_MARKS = {ADDED: "+", REMOVED: "-", CHANGED: "~"}
+# Size of the write buffer of the diff output
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+class SnapshotTree:
+    """A tree saved with --save-snapshot, listed from its TreeModel"""
+
+    def __init__(self, model):
+        self.model = model
+        self.sizes = model.sizes
+        self.root = 0
+
+    def listing(self, row, depth):
+        """Return the entries of a directory as sorted (name, is_dir, size, handle) tuples"""
+        # The columns are read directly, this runs for every directory
+        model = self.model
+        names, name_ids, flags, ends = model.names, model.name_ids, model.flags, model.ends
+        apparent = model.apparent
+        items = []
+        # A snapshot of a start directory that could not be listed has no rows
+        if row >= len(flags):
+            return items
+        child = row + 1
+        end = ends[row]
+        while child < end:
+            is_dir = bool(flags[child] & tree_model.IS_DIR)
+            size = apparent[child] if self.sizes and not is_dir else None
+            items.append((names[name_ids[child]], is_dir, size, child))
+            child = ends[child]
+        items.sort()
+        return items
+
+
+class DirectoryTree:
+    """A directory on disk, listed as walker.walk would list it
+
+    Symlinked directories are left out, as they are not descended into.
+    tree_filter applies the filtering options the other tree was saved
+    with, so they do not show up as changes.
+    """
+
+    def __init__(self, path, sizes=False, tree_filter=None):
+        self.root = path
+        self.sizes = sizes
+        self.tree_filter = tree_filter
+
+    def listing(self, path, depth):
+        """Return the entries of a directory as sorted (name, is_dir, size, handle) tuples"""
+        tree_filter = self.tree_filter
+        if tree_filter is not None and tree_filter.max_depth is not None and depth >= tree_filter.max_depth:
+            return []
+        try:
+            dirs, files = walker.scan_directory(path)
+        except OSError:
+            return []
+        if tree_filter is not None:
+            tree_filter.prune(path, depth, dirs, files)
+        items = [(entry.name, True, None, entry.path) for entry in walker.subdirectories(dirs)]
+        for entry in files:
+            size = disk_usage.file_usage(entry)[0] if self.sizes else None
+            items.append((entry.name, False, size, entry.path))
+        items.sort()
+        return items
+
+
+def open_tree(source, sizes=True, tree_filter=None):
+    """Return a DirectoryTree for a directory, otherwise a SnapshotTree of the snapshot file
+
+    Raises OSError or ValueError for files that cannot be loaded.
+    """
+    if os.path.isdir(source):
+        return DirectoryTree(source, sizes, tree_filter)
+    import snapshot
+    return SnapshotTree(snapshot.load(source))
+
+
+def diff_trees(old, new, sizes=True):
+    """Yield (change, path, is_dir, old_size, new_size) for the differences of two trees
+
+    Both trees are walked together, depth first. The sorted listings of
+    each pair of directories are merged, so only the listings of the
+    directories on the current path and their pending siblings are held,
+    never a whole tree. path is relative to the roots. An entry that
+    turned from a file into a directory, or back, is removed and added. A
+    directory that was added or removed is reported once, without its
+    contents. With sizes, files whose size differs are changed; sizes are
+    None otherwise, and for directories.
+    """
+    # (relative path, depth, old handle, new handle) of directories in both trees
+    stack = [("", 0, old.root, new.root)]
+    while stack:
+        relative, depth, old_dir, new_dir = stack.pop()
+        old_items = old.listing(old_dir, depth)
+        new_items = new.listing(new_dir, depth)
+        subdirs = []
+        old_count, new_count = len(old_items), len(new_items)
+        i = j = 0
+        while i < old_count or j < new_count:
+            if j == new_count or (i < old_count and old_items[i][0] < new_items[j][0]):
+                name, is_dir, size, _ = old_items[i]
+                yield REMOVED, os.path.join(relative, name), is_dir, size, None
+                i += 1
+                continue
+            if i == old_count or new_items[j][0] < old_items[i][0]:
+                name, is_dir, size, _ = new_items[j]
+                yield ADDED, os.path.join(relative, name), is_dir, None, size
+                j += 1
+                continue
+
+            # Most entries are unchanged files, which need no path
+            name, old_is_dir, old_size, old_handle = old_items[i]
+            _, new_is_dir, new_size, new_handle = new_items[j]
+            i += 1
+            j += 1
+            if old_is_dir != new_is_dir:
+                path = os.path.join(relative, name)
+                yield REMOVED, path, old_is_dir, old_size, None
+                yield ADDED, path, new_is_dir, None, new_size
+            elif old_is_dir:
+                subdirs.append((os.path.join(relative, name), depth + 1, old_handle, new_handle))
+            elif sizes and old_size != new_size:
+                yield CHANGED, os.path.join(relative, name), False, old_size, new_size
+        # Reversed, so subdirectories are compared in name order
+        stack.extend(reversed(subdirs))
+
+
+def write_diff(changes, f, format="text"):
+    """Write the changes of diff_trees to a text stream; returns the counts of each kind"""
+    counts = {ADDED: 0, REMOVED: 0, CHANGED: 0}
+    for change, path, is_dir, old_size, new_size in changes:
+        counts[change] += 1
+        if format == "ndjson":
+            record = {"change": change, "path": path, "type": "directory" if is_dir else "file"}
+            if old_size is not None:
+                record["old_size"] = old_size
+            if new_size is not None:
+                record["new_size"] = new_size
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        else:
+            line = f"{TEXT_MARKS[change]} {path}{os.sep if is_dir else ''}"
+            if change == CHANGED:
+                line += f"  {disk_usage.format_size(old_size)} -> {disk_usage.format_size(new_size)}"
+            f.write(line + "\n")
+    if format == "text":
+        f.write(f"{counts[ADDED]:,} added, {counts[REMOVED]:,} removed, {counts[CHANGED]:,} changed\n")
+    return counts
+
+
+def main(argv=None):
+    """Command line of dir_tree.py diff; returns 0 without differences, 1 with, 2 on errors"""
+    parser = argparse.ArgumentParser(
+        prog="dir_tree.py diff",
+        description="Show the entries added, removed and changed between two trees",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Each tree is a snapshot saved with --save-snapshot or a directory.
+
+Examples:
+  python dir_tree.py diff monday.dtsnap tuesday.dtsnap     # Two saved scans
+  python dir_tree.py diff monday.dtsnap /srv/share         # A saved scan against the live share
+  python dir_tree.py diff old.dtsnap new.dtsnap -f ndjson -o changes.ndjson
+        """
+    )
+    parser.add_argument("old", help="Snapshot file or directory to compare from")
+    parser.add_argument("new", help="Snapshot file or directory to compare to")
+    parser.add_argument("-f", "--format", choices=FORMATS, default="text",
+                        help="Output format: text, or one JSON object per change (default: text)")
+    parser.add_argument("-o", "--output", default="-",
+                        help="Output file path, - for stdout (default: -)")
+    parser.add_argument("--no-sizes", action="store_true",
+                        help="Only report added and removed entries, not files whose size changed")
+    parser.add_argument("--max-depth", type=int, metavar="N",
+                        help="For directories, as when the snapshot was saved")
+    parser.add_argument("--exclude", action="append", default=[], metavar="GLOB",
+                        help="For directories, as when the snapshot was saved (repeatable)")
+    parser.add_argument("--include", action="append", default=[], metavar="GLOB",
+                        help="For directories, as when the snapshot was saved (repeatable)")
+    parser.add_argument("--gitignore", action="store_true",
+                        help="For directories, as when the snapshot was saved")
+    args = parser.parse_args(argv)
+
+    # Messages must not end up in the diff when it is written to stdout
+    status = sys.stderr if args.output == "-" else sys.stdout
+    filtered = args.max_depth is not None or args.exclude or args.include or args.gitignore
+    trees = []
+    for source in (args.old, args.new):
+        # Each directory gets its own filter, it keeps state of the walk
+        tree_filter = None
+        if filtered:
+            tree_filter = TreeFilter(args.max_depth, args.exclude, args.include, args.gitignore)
+        try:
+            trees.append(open_tree(source, not args.no_sizes, tree_filter))
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}", file=status)
+            return 2
+    old, new = trees
+
+    sizes = not args.no_sizes
+    for source, tree in ((args.old, old), (args.new, new)):
+        if sizes and not tree.sizes:
+            print(f"Note: {source} has no sizes, files whose size changed are not reported", file=status)
+            sizes = False
+    # Directories are not stat'ed for sizes that are not compared
+    for tree in trees:
+        if isinstance(tree, DirectoryTree):
+            tree.sizes = sizes
+
+    try:
+        if args.output == "-":
+            counts = write_diff(diff_trees(old, new, sizes), sys.stdout, args.format)
+            sys.stdout.flush()
+        else:
+            with compression.open_text(args.output, None, WRITE_BUFFER_SIZE) as f:
+                counts = write_diff(diff_trees(old, new, sizes), f, args.format)
+    except BrokenPipeError:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        return 2
+    except OSError as e:
+        print(f"Error: {e}", file=status)
+        return 2
+    if args.output != "-":
+        print(f"Differences written: {args.output} ({counts[ADDED]:,} added, {counts[REMOVED]:,} removed, "
+              f"{counts[CHANGED]:,} changed)")
+    return 1 if any(counts.values()) else 0
@@ -0,0 +1,210 @@
+"""
+Entry filtering for Directory Tree Generator
+Depth limits, exclude/include globs and .gitignore rules applied during the walk
+"""
+
+import fnmatch
+import os
+import re
+
+# Ignore files honored with use_gitignore, later ones take precedence
+IGNORE_FILES = (".gitignore", ".ignore")
+
+
+class TreeFilter:
+    """Decides which entries are shown and which directories are descended into
+
+    Glob patterns without a slash are matched against entry names, patterns
+    with a slash against the path relative to the start directory. All
+    patterns of a kind are compiled into one regular expression. exclude
+    applies to files and directories, include only to files.
+
+    prune() is called by walker.walk for every listed directory, before the
+    walker descends, so excluded subtrees are never listed or stat'ed.
+    """
+
+    def __init__(self, max_depth=None, exclude=(), include=(), use_gitignore=False):
+        self.max_depth = max_depth
+        self.exclude = tuple(exclude)
+        self.include = tuple(include)
+        self.use_gitignore = use_gitignore
+        self._exclude = _compile_globs(exclude)
+        self._include = _compile_globs(include)
+        self._root = None
+        # (depth, directory, matcher) for the ignore files of open directories
+        self._ignores = []
+
+    def prune(self, path, depth, dirs, files):
+        """Remove filtered entries from the dirs and files lists in place"""
+        if depth == 0:
+            self._root = path
+        while self._ignores and self._ignores[-1][0] >= depth:
+            self._ignores.pop()
+        if self.use_gitignore:
+            matcher = self._read_ignore_files(path, files)
+            if matcher is not None:
+                self._ignores.append((depth, path, matcher))
+
+        dirs[:] = [entry for entry in dirs if self._keep(path, entry.name, True)]
+        files[:] = [entry for entry in files if self._keep(path, entry.name, False)]
+
+    def _keep(self, path, name, is_dir):
+        if is_dir and self.use_gitignore and name == ".git":
+            return False
+        if self._exclude.matches(self._root, path, name):
+            return False
+        if not is_dir and self._include and not self._include.matches(self._root, path, name):
+            return False
+        # The innermost ignore file with a matching rule decides
+        for depth, base, matcher in reversed(self._ignores):
+            ignored = matcher.match(_relative(base, path, name), is_dir)
+            if ignored is not None:
+                return not ignored
+        return True
+
+    def _read_ignore_files(self, path, files):
+        names = {entry.name for entry in files if entry.name in IGNORE_FILES}
+        lines = []
+        for name in IGNORE_FILES:
+            if name in names:
+                try:
+                    with open(os.path.join(path, name), encoding="utf-8", errors="replace") as f:
+                        lines.extend(f.read().splitlines())
+                except OSError:
+                    pass
+        return IgnoreMatcher(lines) if lines else None
+
+
+class _GlobSet:
+    """Name and relative-path glob patterns, each kind compiled into one regex"""
+
+    def __init__(self, name_regex, path_regex):
+        self._name = name_regex
+        self._path = path_regex
+
+    def __bool__(self):
+        return self._name is not None or self._path is not None
+
+    def matches(self, root, path, name):
+        if self._name is not None and self._name.match(name):
+            return True
+        if self._path is not None and root is not None:
+            return bool(self._path.match(_relative(root, path, name)))
+        return False
+
+
+def _compile_globs(patterns):
+    name_patterns = []
+    path_patterns = []
+    for pattern in patterns:
+        pattern = pattern.replace(os.sep, "/").strip("/")
+        if pattern:
+            (path_patterns if "/" in pattern else name_patterns).append(fnmatch.translate(pattern))
+
+    def combine(regexes):
+        return re.compile("|".join(regexes)) if regexes else None
+
+    return _GlobSet(combine(name_patterns), combine(path_patterns))
+
+
+def _relative(base, path, name):
+    # path always starts with base, since both come from the same walk
+    relative = path[len(base):].lstrip(os.sep)
+    if os.sep != "/":
+        relative = relative.replace(os.sep, "/")
+    return f"{relative}/{name}" if relative else name
+
+
+class IgnoreMatcher:
+    """The rules of one or more gitignore-style files, compiled into one regex
+
+    Rules are combined in reverse order, so the first alternative that
+    matches is the last rule in the file, which is the one git applies.
+    """
+
+    def __init__(self, lines):
+        regexes = []
+        self._negated = []
+        for line in lines:
+            rule = _translate_ignore_rule(line)
+            if rule is not None:
+                regex, negated = rule
+                self._negated.append(negated)
+                regexes.append(regex)
+        self._regex = None
+        if regexes:
+            self._regex = re.compile("|".join(
+                f"(?P<r{i}>{regexes[i]})" for i in reversed(range(len(regexes)))
+            ))
+
+    def match(self, relative_path, is_dir):
+        """Return True if ignored, False if re-included by a ! rule, None if no rule matches"""
+        if self._regex is None:
+            return None
+        # Directory-only rules end in "/", so directories are matched with one
+        m = self._regex.fullmatch(relative_path + "/" if is_dir else relative_path)
+        if m is None:
+            return None
+        return not self._negated[int(m.lastgroup[1:])]
+
+
+def _translate_ignore_rule(line):
+    # Returns (regex, negated) for one gitignore line, or None for blank
+    # lines and comments. See gitignore(5) for the pattern format.
+    if not line.strip() or line.startswith("#"):
+        return None
+    if not line.endswith("\\ "):
+        line = line.rstrip()
+    negated = line.startswith("!")
+    if negated:
+        line = line[1:]
+    if line.startswith("\\"):
+        line = line[1:]
+
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    # A slash anywhere but the end anchors the rule to the ignore file's directory
+    anchored = "/" in line
+    line = line.lstrip("/")
+    if not line:
+        return None
+
+    parts = []
+    i = 0
+    while i < len(line):
+        if line.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif line.startswith("/**", i) and i + 3 == len(line):
+            parts.append("/.*")
+            i += 3
+        elif line[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif line[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        elif line[i] == "[":
+            end = line.find("]", i + 2)
+            if end < 0:
+                parts.append(re.escape("["))
+                i += 1
+            else:
+                body = line[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                parts.append("[" + body.replace("\\", "\\\\") + "]")
+                i = end + 1
+        elif line[i] == "\\" and i + 1 < len(line):
+            parts.append(re.escape(line[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(line[i]))
+            i += 1
+
+    regex = "".join(parts)
+    if not anchored:
+        regex = "(?:.*/)?" + regex
+    # Directory-only rules need the trailing "/" directories are matched with
+    regex += "/" if dir_only else "/?"
+    return regex, negated
@@ -0,0 +1,235 @@
+"""
+In-memory tree model for Directory Tree Generator
+Stores a scanned tree in array columns instead of one object per entry
+"""
+
+import os
+import sys
+import time
+from array import array
+
+import disk_usage
+import walker
+
+# Bits of the flags column
+IS_DIR = 1
+IS_SYMLINK = 2
+
+NO_PARENT = -1
+
+
+def scan_tree(start_path, sizes=False, follow_symlinks=False, workers=1, index=None, tree_filter=None,
+              scan=None):
+    """Walk start_path and return it as a TreeModel
+
+    The arguments mean the same as for generate_tree; with sizes, file
+    sizes are stored and rolled up into directory totals. scan, if given,
+    lists directories instead of the index or walker.scan_directory.
+    """
+    if scan is None:
+        scan = index.scan if index is not None else walker.scan_directory
+    model = TreeModel(sizes)
+    entries = walker.walk(start_path, follow_symlinks, workers=workers, scan=scan, tree_filter=tree_filter)
+    for _ in model.record(entries, follow_symlinks):
+        pass
+    return model
+
+
+class TreeModel:
+    """A scanned tree held in array columns, one row per entry
+
+    Rows are in walk order: each directory is followed by its files and
+    then by its subdirectories, each with its own subtree. The columns are
+    the parent row, an index into a table of distinct names, flags
+    (IS_DIR, IS_SYMLINK) and the end of each entry's subtree, i.e. the row
+    after its last descendant. Directories that are not descended into,
+    like symlinks when they are not followed, are left out as in the
+    rendered tree. With sizes, apparent and allocated bytes are stored
+    too, for directories as totals.
+
+    A row costs 13 bytes, 29 with sizes, plus the distinct names. As
+    measured with memory_usage(): 61 bytes per entry (77 with sizes) for
+    /usr of a Linux system, 84k entries of which 66% have distinct names;
+    14 bytes per entry for a generated 204k-entry tree of repeated names.
+    10 million entries thus take well under 1 GiB, against several GiB
+    for one object per entry.
+    """
+
+    def __init__(self, sizes=False):
+        self.sizes = sizes
+        self.parents = array("i")
+        self.name_ids = array("I")
+        self.flags = array("B")
+        self.ends = array("I")
+        self.apparent = array("Q") if sizes else None
+        self.allocated = array("Q") if sizes else None
+        # Seconds since the epoch when the scan started
+        self.scanned_at = None
+        # Distinct names; the lookup dict is only needed while scanning
+        self.names = []
+        self._names_index = {}
+
+    def __len__(self):
+        return len(self.flags)
+
+    def name(self, row):
+        return self.names[self.name_ids[row]]
+
+    def path(self, row):
+        """Return the full path of a row; the root row's name is the start path"""
+        names = []
+        while row != NO_PARENT:
+            names.append(self.name(row))
+            row = self.parents[row]
+        return os.path.join(*reversed(names))
+
+    def is_dir(self, row):
+        return bool(self.flags[row] & IS_DIR)
+
+    def is_symlink(self, row):
+        return bool(self.flags[row] & IS_SYMLINK)
+
+    def usage(self, row):
+        """Return (apparent, allocated) bytes of a row, totals for directories; None without sizes"""
+        if not self.sizes:
+            return None
+        return self.apparent[row], self.allocated[row]
+
+    def children(self, row):
+        """Yield the rows directly below a directory, files first"""
+        child = row + 1
+        end = self.ends[row]
+        while child < end:
+            yield child
+            child = self.ends[child]
+
+    def entries(self):
+        """Yield the tree as (path, depth, dirs, files), like walker.walk
+
+        The result can be rendered in any format with dir_tree.write_tree;
+        with sizes, the stored sizes are used instead of the filesystem.
+        """
+        names, name_ids, flags, ends = self.names, self.name_ids, self.flags, self.ends
+        sizes, apparent, allocated = self.sizes, self.apparent, self.allocated
+        Entry = walker.Entry
+        # (row, path, depth) of the directories on the path to the current one
+        stack = []
+        row = 0
+        while row < len(flags):
+            parent = self.parents[row]
+            while stack and stack[-1][0] != parent:
+                stack.pop()
+            if stack:
+                path = os.path.join(stack[-1][1], names[name_ids[row]])
+                depth = stack[-1][2] + 1
+            else:
+                path = names[name_ids[row]]
+                depth = 0
+
+            files = []
+            child = row + 1
+            end = ends[row]
+            # Files are most of the rows, so their entries are built here
+            # rather than by _entry
+            while child < end:
+                file_flags = flags[child]
+                if file_flags & IS_DIR:
+                    break
+                entry = Entry(path, names[name_ids[child]], False, bool(file_flags & IS_SYMLINK))
+                if sizes:
+                    entry._stat = _StoredStat(apparent[child], allocated[child])
+                files.append(entry)
+                child += 1
+            dirs = [self._entry(path, subdir) for subdir in self._siblings(child, end)]
+            yield path, depth, dirs, files
+            stack.append((row, path, depth))
+            row = child
+
+    def record(self, entries, follow_symlinks=False):
+        """Append (path, depth, dirs, files) walk entries to the model, passing them through
+
+        The model is complete once the entries are exhausted; with sizes,
+        file sizes are read from the entries.
+        """
+        self.scanned_at = time.time()
+        # Rows of the directories on the path to the current one, one per level
+        open_dirs = []
+        for path, depth, dirs, files in entries:
+            while len(open_dirs) > depth:
+                self._close(open_dirs.pop())
+            if open_dirs:
+                flags = IS_DIR | (IS_SYMLINK if follow_symlinks and os.path.islink(path) else 0)
+                current = self._append(open_dirs[-1], os.path.basename(path), flags)
+            else:
+                current = self._append(NO_PARENT, path, IS_DIR)
+            open_dirs.append(current)
+
+            for entry in files:
+                flags = IS_SYMLINK if walker.is_symlink(entry) else 0
+                if self.sizes:
+                    self._append(current, entry.name, flags, *disk_usage.file_usage(entry))
+                else:
+                    self._append(current, entry.name, flags)
+            yield path, depth, dirs, files
+        while open_dirs:
+            self._close(open_dirs.pop())
+        self._names_index = None
+
+    def memory_usage(self):
+        """Return the bytes used by the columns and the name table"""
+        columns = [self.parents, self.name_ids, self.flags, self.ends]
+        if self.sizes:
+            columns += [self.apparent, self.allocated]
+        size = sum(sys.getsizeof(column) for column in columns)
+        return size + sys.getsizeof(self.names) + sum(sys.getsizeof(name) for name in self.names)
+
+    def _siblings(self, row, end):
+        while row < end:
+            yield row
+            row = self.ends[row]
+
+    def _entry(self, path, row):
+        flags = self.flags[row]
+        entry = walker.Entry(path, self.names[self.name_ids[row]], is_dir=bool(flags & IS_DIR),
+                             is_symlink=bool(flags & IS_SYMLINK))
+        if self.sizes:
+            entry._stat = _StoredStat(self.apparent[row], self.allocated[row])
+        return entry
+
+    def _append(self, parent, name, flags, apparent=0, allocated=0):
+        row = len(self.flags)
+        name_id = self._names_index.get(name)
+        if name_id is None:
+            name_id = self._names_index[name] = len(self.names)
+            self.names.append(name)
+        self.parents.append(parent)
+        self.name_ids.append(name_id)
+        self.flags.append(flags)
+        # Directories get their end when they are closed
+        self.ends.append(row + 1)
+        if self.sizes:
+            self.apparent.append(apparent)
+            self.allocated.append(allocated)
+            if parent != NO_PARENT:
+                self.apparent[parent] += apparent
+                self.allocated[parent] += allocated
+        return row
+
+    def _close(self, row):
+        self.ends[row] = len(self.flags)
+        parent = self.parents[row]
+        if self.sizes and parent != NO_PARENT:
+            self.apparent[parent] += self.apparent[row]
+            self.allocated[parent] += self.allocated[row]
+
+
+class _StoredStat:
+    """The parts of a stat result disk_usage needs, rebuilt from stored sizes"""
+
+    __slots__ = ("st_size", "st_blocks")
+    st_nlink = 1
+
+    def __init__(self, apparent, allocated):
+        self.st_size = apparent
+        # Allocated sizes that are not whole blocks came from the st_size fallback
+        self.st_blocks = allocated // 512 if allocated % 512 == 0 else None
@@ -0,0 +1,40 @@
+"""
+Tree options for Directory Tree Generator
+The scan and render settings of a run, built once and shared by every tree it generates
+"""
+
+import renderers
+
+
+class TreeOptions:
+    """How trees are scanned and rendered
+
+    The command line builds one for all trees of a run; generate_tree,
+    write_tree, watch_tree, the shard processes and the tree server all
+    read their settings from it, so an option cannot be dropped on one of
+    these paths. It is pickled for the shard processes; tree_filter (a
+    tree_filter.TreeFilter) travels along with the rules it has read.
+    Per-tree state, like the output file, progress and pools, is passed
+    to generate_tree separately.
+    """
+
+    def __init__(self, format="text", sizes=False, top=0, workers=1, processes=1, follow_symlinks=False,
+                 count_hardlinks_once=False, compress_level=None, tree_filter=None):
+        self.format = format
+        self.sizes = sizes
+        self.top = top
+        self.workers = workers
+        self.processes = processes
+        self.follow_symlinks = follow_symlinks
+        self.count_hardlinks_once = count_hardlinks_once
+        self.compress_level = compress_level
+        self.tree_filter = tree_filter
+
+    @property
+    def measure(self):
+        # File sizes are read for the largest entries summary too
+        return self.sizes or self.top > 0
+
+    def renderer(self):
+        """Return a new renderer of the format"""
+        return renderers.get_renderer(self.format, self.sizes)
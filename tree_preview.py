@@ -0,0 +1,165 @@
+"""
+Tree preview for Directory Tree Generator
+A ttk.Treeview that lists each directory only when it is expanded
+"""
+
+import os
+import tkinter as tk
+from collections import OrderedDict
+from tkinter import ttk
+
+import walker
+
+# Listings of this many recently expanded directories are kept
+DEFAULT_CACHE_SIZE = 256
+# Children inserted at a time; the rest are behind a "more" item
+PAGE_SIZE = 1000
+
+
+class ListingCache:
+    """Least recently used directory listings, revalidated by mtime
+
+    listing() returns the names of a directory's subdirectories and files,
+    sorted for browsing. Symlinked directories are left out, as in the
+    generated trees.
+    """
+
+    def __init__(self, capacity=DEFAULT_CACHE_SIZE):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        # path: (st_mtime_ns, dirs, files)
+        self._listings = OrderedDict()
+
+    def listing(self, path):
+        """Return (dirs, files) name lists of a directory"""
+        mtime_ns = os.stat(path).st_mtime_ns
+        cached = self._listings.get(path)
+        if cached is not None and cached[0] == mtime_ns:
+            self._listings.move_to_end(path)
+            self.hits += 1
+            return cached[1], cached[2]
+
+        self.misses += 1
+        dirs, files = walker.scan_directory(path)
+        dirs = sorted((entry.name for entry in walker.subdirectories(dirs)), key=str.lower)
+        files = sorted((entry.name for entry in files), key=str.lower)
+        self._listings[path] = (mtime_ns, dirs, files)
+        self._listings.move_to_end(path)
+        while len(self._listings) > self.capacity:
+            self._listings.popitem(last=False)
+        return dirs, files
+
+
+class TreePreview(ttk.Frame):
+    """Browsable tree of path, listed one directory at a time
+
+    Only expanded directories have items in the widget: collapsing a
+    directory drops its children again, and re-expanding it is served
+    from the listing cache. Large directories are inserted PAGE_SIZE
+    children at a time.
+    """
+
+    def __init__(self, master, path, cache=None):
+        super().__init__(master)
+        self.cache = cache if cache is not None else ListingCache()
+        self.tree = ttk.Treeview(self, show="tree", selectmode="browse")
+        scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+
+        # Item ids of directories and their paths
+        self._paths = {}
+        # Item id of a "more" item: (directory item, dirs, files, next index)
+        self._more = {}
+        self.tree.bind("<<TreeviewOpen>>", self._on_open)
+        self.tree.bind("<<TreeviewClose>>", self._on_close)
+        self.tree.bind("<<TreeviewSelect>>", self._on_select)
+
+        root = self._insert_directory("", path, os.path.basename(path.rstrip(os.sep)) or path)
+        self.tree.item(root, open=True)
+        self._expand(root)
+
+    def selected_directory(self):
+        """Return the path of the selected directory, or None"""
+        selection = self.tree.selection()
+        return self._paths.get(selection[0]) if selection else None
+
+    def _insert_directory(self, parent, path, name):
+        item = self.tree.insert(parent, "end", text=name + "/")
+        self._paths[item] = path
+        # Placeholder, so the directory can be expanded before it is listed
+        self.tree.insert(item, "end", text="")
+        return item
+
+    def _on_open(self, event):
+        self._expand(self.tree.focus())
+
+    def _on_close(self, event):
+        item = self.tree.focus()
+        if item in self._paths:
+            self._clear(item)
+            self.tree.insert(item, "end", text="")
+
+    def _on_select(self, event):
+        for item in self.tree.selection():
+            if item in self._more:
+                parent, dirs, files, start = self._more.pop(item)
+                self.tree.delete(item)
+                self._insert_page(parent, dirs, files, start)
+
+    def _expand(self, item):
+        path = self._paths.get(item)
+        if path is None:
+            return
+        self._clear(item)
+        try:
+            dirs, files = self.cache.listing(path)
+        except OSError as e:
+            self.tree.insert(item, "end", text=f"(cannot list: {e.strerror})")
+            return
+        self._insert_page(item, dirs, files, 0)
+
+    def _insert_page(self, item, dirs, files, start):
+        path = self._paths[item]
+        stop = min(start + PAGE_SIZE, len(dirs) + len(files))
+        for index in range(start, stop):
+            if index < len(dirs):
+                self._insert_directory(item, os.path.join(path, dirs[index]), dirs[index])
+            else:
+                self.tree.insert(item, "end", text=files[index - len(dirs)])
+        remaining = len(dirs) + len(files) - stop
+        if remaining:
+            more = self.tree.insert(item, "end", text=f"... {remaining:,} more (select to show)")
+            self._more[more] = (item, dirs, files, stop)
+
+    def _clear(self, item):
+        # Removes the children of item and forgets the ones that were expanded
+        stack = list(self.tree.get_children(item))
+        while stack:
+            child = stack.pop()
+            self._paths.pop(child, None)
+            self._more.pop(child, None)
+            stack.extend(self.tree.get_children(child))
+        self.tree.delete(*self.tree.get_children(item))
+
+
+def open_preview(master, path, on_export, cache=None):
+    """Open a preview window of path; on_export(directory) is called for the Export button"""
+    window = tk.Toplevel(master)
+    window.title(f"Preview - {path}")
+    window.geometry("500x600")
+    preview = TreePreview(window, path, cache)
+
+    def export():
+        directory = preview.selected_directory()
+        if directory is not None:
+            on_export(directory)
+
+    buttons = ttk.Frame(window)
+    buttons.pack(side="bottom", fill="x")
+    ttk.Button(buttons, text="Export Selected Directory", command=export).pack(side="left", padx=5, pady=5)
+    ttk.Button(buttons, text="Close", command=window.destroy).pack(side="right", padx=5, pady=5)
+    preview.pack(fill="both", expand=True)
+    return preview
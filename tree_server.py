@@ -0,0 +1,363 @@
+"""
+Tree server for Directory Tree Generator
+Keeps recent scans in memory and renders trees for clients over a Unix domain socket
+"""
+
+import io
+import json
+import os
+import shutil
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import renderers
+import tree_model
+import walker
+from tree_filter import TreeFilter
+from tree_options import TreeOptions
+
+# Version of the request and response messages
+PROTOCOL_VERSION = 1
+# Scans of this many trees are kept, least recently used ones are dropped first
+DEFAULT_CACHE_SIZE = 16
+# ... or fewer, so that they take at most this much memory
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+# Scans older than this are redone even if no directory changed, so file
+# size changes, which do not touch directory mtimes, show up eventually
+DEFAULT_MAX_AGE = 300
+# Seconds a client waits for the server to accept the connection
+CONNECT_TIMEOUT = 2.0
+# Options a request may carry, with their defaults; they mean the same as
+# the CLI options of the same names
+REQUEST_OPTIONS = {
+    "sizes": False,
+    "top": 0,
+    "follow_symlinks": False,
+    "compress_level": None,
+    "max_depth": None,
+    "exclude": [],
+    "include": [],
+    "gitignore": False,
+}
+
+
+class ServerError(Exception):
+    """Raised by the client when the server cannot serve a request"""
+
+
+def default_socket_path():
+    """Return the per-user socket path: in XDG_RUNTIME_DIR, else in the temp directory"""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, "dir_tree.sock")
+    return os.path.join(tempfile.gettempdir(), f"dir_tree-{os.getuid()}.sock")
+
+
+class ScanCache:
+    """Least recently used TreeModel scans, revalidated by directory mtimes
+
+    A scan is reused while every listed directory still has the mtime it
+    had when it was listed, i.e. no entry was added, removed or renamed,
+    and it is younger than max_age seconds. Checking costs one stat per
+    directory instead of listing it.
+    """
+
+    def __init__(self, capacity=DEFAULT_CACHE_SIZE, max_bytes=DEFAULT_CACHE_BYTES, max_age=DEFAULT_MAX_AGE):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key: (model, [(directory, st_mtime_ns)], counts, scanned at, bytes)
+        self._scans = OrderedDict()
+
+    def get(self, key, scan):
+        """Return (model, counts, cached) for key
+
+        On a miss, scan() returns (model, directory mtimes, counts); counts
+        are whatever the caller wants kept with the scan.
+        """
+        with self._lock:
+            cached = self._scans.get(key)
+        if cached is not None and self._current(cached):
+            with self._lock:
+                if key in self._scans:
+                    self._scans.move_to_end(key)
+                self.hits += 1
+            return cached[0], cached[2], True
+
+        model, mtimes, counts = scan()
+        size = model.memory_usage()
+        with self._lock:
+            self.misses += 1
+            self._scans[key] = (model, mtimes, counts, time.monotonic(), size)
+            self._scans.move_to_end(key)
+            while len(self._scans) > self.capacity or (
+                    len(self._scans) > 1 and sum(item[4] for item in self._scans.values()) > self.max_bytes):
+                self._scans.popitem(last=False)
+        return model, counts, False
+
+    def written(self, key, before):
+        """Keep the server's own output from invalidating the scan of key
+
+        before maps the directories an output was just written to, and the
+        output directories themselves, to their mtimes before the write.
+        Those whose mtime was still the listed one get their mtime after
+        the write recorded instead, so a tree written into the scanned
+        directory does not force a rescan on the next request.
+        """
+        with self._lock:
+            cached = self._scans.get(key)
+            if cached is None:
+                return
+            mtimes = []
+            for path, mtime_ns in cached[1]:
+                if before.get(path) == mtime_ns:
+                    mtime_ns = _mtime(path)
+                mtimes.append((path, mtime_ns))
+            self._scans[key] = (cached[0], mtimes) + cached[2:]
+
+    def _current(self, cached):
+        model, mtimes, counts, scanned_at, size = cached
+        if time.monotonic() - scanned_at > self.max_age:
+            return False
+        try:
+            return all(os.stat(path).st_mtime_ns == mtime_ns for path, mtime_ns in mtimes)
+        except OSError:
+            return False
+
+
+class TreeServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves tree requests on a Unix domain socket, one thread per connection
+
+    A request is one line of JSON: path, output (a file path, or "-" to
+    get the tree back over the connection), format and REQUEST_OPTIONS.
+    The answer is one line of JSON, with "ok" and either "error" or the
+    entry counts, whether the scan was cached and the time taken, followed
+    for "-" by the tree itself. write_tree(entries, output, options)
+    renders a tree, as dir_tree.write_tree does.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, write_tree, workers=1, cache=None):
+        self.socket_path = socket_path
+        self.write_tree = write_tree
+        self.workers = workers
+        self.cache = cache if cache is not None else ScanCache()
+        _remove_stale_socket(socket_path)
+        # Only the user running the server may connect
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.remove(self.socket_path)
+        except OSError:
+            pass
+
+    def generate(self, request, stream=None):
+        """Render the tree of a request to its output, or to stream for "-"; return the answer"""
+        start = time.perf_counter()
+        path = os.path.abspath(request["path"])
+        options = {name: request.get(name, default) for name, default in REQUEST_OPTIONS.items()}
+        tree_filter_options = (options["max_depth"], tuple(options["exclude"]), tuple(options["include"]),
+                               options["gitignore"])
+        # The filter is made for each scan, it keeps state of the walk
+        tree_options = TreeOptions(request.get("format", "text"), options["sizes"], options["top"], self.workers,
+                                   follow_symlinks=options["follow_symlinks"],
+                                   compress_level=options["compress_level"])
+        # Stored sizes are needed for --top too
+        key = (path, tree_options.measure, tree_options.follow_symlinks, tree_filter_options)
+
+        def scan():
+            mtimes = []
+
+            def listed(directory):
+                # The mtime is taken before listing, so a change during the
+                # listing invalidates the scan
+                mtimes.append((directory, os.stat(directory).st_mtime_ns))
+                return walker.scan_directory(directory)
+
+            tree_filter = TreeFilter(*tree_filter_options) if any(tree_filter_options) else None
+            model = tree_model.scan_tree(path, tree_options.measure, tree_options.follow_symlinks,
+                                         tree_options.workers, tree_filter=tree_filter, scan=listed)
+            # Counted once per scan, from the flags column, not per request
+            directories = sum(1 for flags in model.flags if flags & tree_model.IS_DIR)
+            return model, mtimes, (directories, len(model) - directories)
+
+        if not os.path.isdir(path):
+            return {"ok": False, "error": f"'{request['path']}' is not a valid directory"}
+        if tree_options.format not in renderers.renderer_names():
+            return {"ok": False, "error": f"Unknown output format: {tree_options.format}"}
+        model, (directories, files), cached = self.cache.get(key, scan)
+        output = request.get("output", "-")
+        target = stream if output == "-" else output
+        # The default output is inside the scanned directory
+        written = {}
+        if output != "-":
+            for written_path in tree_options.renderer().output_paths(output):
+                written_path = os.path.abspath(written_path)
+                for directory in (os.path.dirname(written_path), written_path):
+                    written[directory] = _mtime(directory)
+        if not self.write_tree(model.entries(), target, tree_options):
+            return {"ok": False, "error": "Failed to generate directory tree"}
+        self.cache.written(key, written)
+        return {"ok": True, "cached": cached, "directories": directories, "files": files,
+                "seconds": time.perf_counter() - start}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            self._handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away, e.g. its output was piped into head
+            pass
+
+    def _handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            if not isinstance(request, dict):
+                raise ValueError("not a JSON object")
+            if request.get("version") != PROTOCOL_VERSION:
+                raise ValueError(f"unsupported protocol version {request.get('version')}")
+            if not isinstance(request.get("path"), str):
+                raise ValueError("no path")
+        except ValueError as e:
+            self._answer({"ok": False, "error": f"Bad request: {e}"})
+            return
+
+        if request.get("output", "-") != "-":
+            self._answer(self.server.generate(request))
+            return
+
+        # The tree follows the answer, so it is rendered into a temporary
+        # file first; errors can still be reported and the connection
+        # is not held up by a slow client while the tree is rendered
+        with tempfile.TemporaryFile() as buffer:
+            text = io.TextIOWrapper(buffer, encoding='utf-8', write_through=False)
+            answer = self.server.generate(request, text)
+            text.flush()
+            text.detach()
+            self._answer(answer)
+            if answer["ok"]:
+                buffer.seek(0)
+                shutil.copyfileobj(buffer, self.wfile)
+
+    def _answer(self, answer):
+        self.wfile.write(json.dumps(answer).encode('utf-8') + b"\n")
+
+
+def _mtime(path):
+    # None for paths that do not exist (yet), which match no listed mtime
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _remove_stale_socket(socket_path):
+    # A socket file nobody listens on is left over from a server that did
+    # not shut down cleanly
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.remove(socket_path)
+    else:
+        raise ServerError(f"A tree server is already listening on {socket_path}")
+    finally:
+        probe.close()
+
+
+def serve(write_tree, socket_path=None, workers=1, cache=None):
+    """Run a TreeServer until interrupted"""
+    if not hasattr(socket, "AF_UNIX"):
+        raise ServerError("The tree server needs Unix domain sockets, which this platform lacks")
+    server = TreeServer(socket_path or default_socket_path(), write_tree, workers, cache)
+    print(f"Serving directory trees on {server.socket_path}, press Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def _request_options(options):
+    # The REQUEST_OPTIONS of a TreeOptions
+    tree_filter = options.tree_filter
+    if tree_filter is None:
+        tree_filter = TreeFilter()
+    return {
+        "sizes": options.sizes,
+        "top": options.top,
+        "follow_symlinks": options.follow_symlinks,
+        "compress_level": options.compress_level,
+        "max_depth": tree_filter.max_depth,
+        "exclude": list(tree_filter.exclude),
+        "include": list(tree_filter.include),
+        "gitignore": tree_filter.use_gitignore,
+    }
+
+
+def request_tree(path, output_file, options=None, socket_path=None, stream=None):
+    """Have the server generate a tree and return its answer
+
+    options (a TreeOptions) is sent as the request's format and
+    REQUEST_OPTIONS; workers, processes and count_hardlinks_once are the
+    server's own. output_file is made absolute, since the server has its
+    own working directory; for "-" the tree is copied to stream (binary,
+    default stdout). ServerError is raised when no server answers or it
+    reports an error.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        raise ServerError("Unix domain sockets are not available")
+    socket_path = socket_path or default_socket_path()
+    options = options or TreeOptions()
+    request = dict(_request_options(options), version=PROTOCOL_VERSION, path=os.path.abspath(path),
+                   format=options.format,
+                   output=output_file if output_file == "-" else os.path.abspath(output_file))
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.settimeout(CONNECT_TIMEOUT)
+        try:
+            connection.connect(socket_path)
+        except OSError as e:
+            raise ServerError(f"No tree server on {socket_path}: {e.strerror or e}")
+        # Scans of large trees take as long as they take
+        connection.settimeout(None)
+        with connection.makefile('rb') as reader:
+            try:
+                connection.sendall(json.dumps(request).encode('utf-8') + b"\n")
+                line = reader.readline()
+            except OSError as e:
+                raise ServerError(f"The tree server failed: {e.strerror or e}")
+            if not line:
+                raise ServerError("The tree server closed the connection")
+            answer = json.loads(line)
+            if not answer.get("ok"):
+                raise ServerError(answer.get("error", "The tree server could not generate the tree"))
+            if output_file == "-":
+                if stream is None:
+                    sys.stdout.flush()
+                    stream = sys.stdout.buffer
+                shutil.copyfileobj(reader, stream)
+                stream.flush()
+        return answer
+    finally:
+        connection.close()
@@ -0,0 +1,199 @@
+"""
+Directory walker for Directory Tree Generator
+Lists directories with os.scandir and tracks depth explicitly
+"""
+
+import os
+
+
+class Entry:
+    """Minimal os.DirEntry stand-in for listings that were not read with os.scandir"""
+
+    __slots__ = ("name", "_parent", "_is_dir", "_is_symlink", "_stat")
+
+    def __init__(self, parent, name, is_dir=False, is_symlink=False):
+        self.name = name
+        self._parent = parent
+        self._is_dir = is_dir
+        self._is_symlink = is_symlink
+        self._stat = None
+
+    @property
+    def path(self):
+        # Built on demand, most entries are only ever rendered by name
+        return os.path.join(self._parent, self.name)
+
+    def is_dir(self, follow_symlinks=True):
+        return self._is_dir
+
+    def is_symlink(self):
+        return self._is_symlink
+
+    def stat(self, follow_symlinks=True):
+        if not follow_symlinks or not self._is_symlink:
+            if self._stat is None:
+                self._stat = os.stat(self.path, follow_symlinks=False)
+            return self._stat
+        return os.stat(self.path)
+
+    def __repr__(self):
+        return f"<Entry {self.name!r}>"
+
+
+def scan_directory(path):
+    """List a directory and split its entries into directories and files"""
+    dirs = []
+    files = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                dirs.append(entry)
+            else:
+                files.append(entry)
+    return dirs, files
+
+
+def subdirectories(dirs, follow_symlinks=False):
+    """Return the directory entries the walker descends into"""
+    return [entry for entry in dirs if follow_symlinks or not is_symlink(entry)]
+
+
+def walk(top, follow_symlinks=False, workers=1, depth=0, scan=scan_directory, tree_filter=None,
+         visited=None, pool=None, ignore=()):
+    """Yield (path, depth, dirs, files) for every directory below top, top-down
+
+    dirs and files are lists of os.DirEntry objects, so their cached
+    is_dir()/stat() results can be reused by the caller. As with os.walk,
+    the caller may trim dirs in place to stop the walker descending into
+    them. Directories that cannot be listed are skipped.
+
+    With workers > 1 the subdirectories of each yielded directory are listed
+    ahead of time in a thread pool, which hides per-directory latency on
+    network filesystems. The order of the results does not change. pool,
+    if given, is an executor used instead of a new one of workers threads,
+    so walks of several trees can share it.
+
+    depth is the depth reported for top, for walks of a subtree. scan lists
+    one directory; it can be replaced, e.g. by a cached lister.
+
+    tree_filter (a tree_filter.TreeFilter) prunes each listing before it is
+    yielded. Directories at its max_depth are yielded without being listed.
+
+    With follow_symlinks, symlinked directories are descended into and every
+    directory is identified by (st_dev, st_ino); one that was already
+    visited, e.g. through a symlink loop, is not descended into again.
+    visited is the set of identities to start from, it is updated in place.
+
+    Entries at the paths in ignore are left out of the listings, e.g. the
+    output file when it is written inside the walked tree.
+    """
+    ignored = _ignored_names(ignore)
+    if follow_symlinks and visited is None:
+        visited = set()
+        first_visit(visited, top)
+    if pool is not None:
+        yield from _walk(top, depth, follow_symlinks, scan, pool.submit, tree_filter, visited, ignored)
+    elif workers > 1:
+        # Imported here, concurrent.futures is slow to import for short runs
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            yield from _walk(top, depth, follow_symlinks, scan, pool.submit, tree_filter, visited, ignored)
+    else:
+        yield from _walk(top, depth, follow_symlinks, scan, _Deferred, tree_filter, visited, ignored)
+
+
+def first_visit(visited, path):
+    """Add the directory at path to visited; returns False if it already was there"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    # One int per directory keeps the set compact
+    key = (st.st_dev << 64) | st.st_ino
+    if key in visited:
+        return False
+    visited.add(key)
+    return True
+
+
+def _ignored_names(paths):
+    # {absolute directory: names to leave out of its listing}, so each
+    # listing costs one lookup rather than one per entry
+    ignored = {}
+    for path in paths:
+        path = os.path.abspath(path)
+        ignored.setdefault(os.path.dirname(path), set()).add(os.path.basename(path))
+    return ignored
+
+
+def _walk(top, depth, follow_symlinks, scan, submit, tree_filter, visited, ignored):
+    max_depth = tree_filter.max_depth if tree_filter is not None else None
+
+    def request(path, depth):
+        if max_depth is not None and depth >= max_depth:
+            return _Deferred(_unlisted, path)
+        return submit(scan, path)
+
+    # Each stack item carries its own depth, so no path arithmetic is needed.
+    # Siblings are pushed in reverse to keep the same order as os.walk.
+    stack = [(top, depth, request(top, depth))]
+    try:
+        while stack:
+            path, depth, listing = stack.pop()
+            try:
+                dirs, files = listing.result()
+            except OSError:
+                continue
+
+            if ignored:
+                names = ignored.get(os.path.abspath(path))
+                if names:
+                    dirs = [entry for entry in dirs if entry.name not in names]
+                    files = [entry for entry in files if entry.name not in names]
+            if tree_filter is not None:
+                tree_filter.prune(path, depth, dirs, files)
+            yield path, depth, dirs, files
+
+            # Listings are only requested after pruning, and after the caller
+            # had the chance to trim dirs, so excluded subtrees are never read
+            pending = [
+                (entry.path, depth + 1, request(entry.path, depth + 1))
+                for entry in subdirectories(dirs, follow_symlinks)
+                if visited is None or first_visit(visited, entry.path)
+            ]
+            stack.extend(reversed(pending))
+    finally:
+        for path, depth, listing in stack:
+            listing.cancel()
+
+
+def _unlisted(path):
+    return [], []
+
+
+class _Deferred:
+    """Stand-in for a Future that lists the directory when asked for it"""
+
+    __slots__ = ("fn", "path")
+
+    def __init__(self, fn, path):
+        self.fn = fn
+        self.path = path
+
+    def result(self):
+        return self.fn(self.path)
+
+    def cancel(self):
+        return True
+
+
+def is_symlink(entry):
+    """Return entry.is_symlink(), treating errors as not a symlink"""
+    try:
+        return entry.is_symlink()
+    except OSError:
+        return False
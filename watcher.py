@@ -0,0 +1,313 @@
+"""
+Watch mode for Directory Tree Generator (Linux only)
+Keeps an in-memory tree up to date from inotify events
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+import walker
+
+# inotify(7) constants
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF
+              | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+# Kernel memory charged per watch on 64-bit systems, see fs/notify/inotify
+KERNEL_BYTES_PER_WATCH = 1024
+MAX_USER_WATCHES_FILE = "/proc/sys/fs/inotify/max_user_watches"
+
+_EVENT_HEADER = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+
+class WatchError(Exception):
+    """Raised when inotify is not available"""
+
+
+class _Inotify:
+    """Thin ctypes binding for inotify_init1/inotify_add_watch/inotify_rm_watch"""
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise WatchError("inotify is only available on Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        try:
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+            init = libc.inotify_init1
+        except AttributeError:
+            raise WatchError("libc does not provide inotify")
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        self.fd = init(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise WatchError(f"inotify_init1 failed: {os.strerror(err)}")
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """Yield (wd, mask, cookie, name) for all queued events"""
+        while True:
+            try:
+                data = os.read(self.fd, _READ_SIZE)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                yield wd, mask, cookie, name
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _DirNode:
+    """One directory of the watched tree"""
+
+    __slots__ = ("name", "parent", "dirs", "files", "wd")
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.dirs = {}
+        # dict used as an insertion-ordered set of file names; None until
+        # the directory has been listed
+        self.files = None
+        self.wd = None
+
+    def path(self):
+        names = []
+        node = self
+        while node.parent is not None:
+            names.append(node.name)
+            node = node.parent
+        return os.path.join(node.name, *reversed(names))
+
+
+def max_user_watches():
+    """Return the per-user inotify watch limit, or None if unknown"""
+    try:
+        with open(MAX_USER_WATCHES_FILE) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+class TreeWatcher:
+    """In-memory tree of start_path kept current through inotify
+
+    entries() yields the tree in the (path, depth, dirs, files) shape of
+    walker.walk, so it can be rendered like a fresh scan. Paths in ignore
+    (e.g. the output file) are left out of the tree and their events are
+    ignored.
+    """
+
+    def __init__(self, start_path, ignore=()):
+        self.start_path = start_path
+        self.ignore = {os.path.abspath(path) for path in ignore}
+        self.root = None
+        self.watch_limit = max_user_watches()
+        # Directories that could not be watched, e.g. past the watch limit
+        self.unwatched = 0
+        self._inotify = _Inotify()
+        self._nodes = {}
+        # Directories with pending changes, relisted before rendering
+        self._dirty = {}
+
+    @property
+    def watches(self):
+        return len(self._nodes)
+
+    def scan(self):
+        """Build the tree from scratch and watch every directory in it"""
+        for wd in list(self._nodes):
+            self._inotify.rm_watch(wd)
+        self._nodes.clear()
+        self._dirty.clear()
+        self.unwatched = 0
+        self.root = _DirNode(self.start_path)
+        self._scan_into(self.root)
+
+    def entries(self):
+        """Yield the current tree as (path, depth, dirs, files), top-down"""
+        if self.root is None:
+            return
+        self._refresh()
+        stack = [(self.root, self.root.path(), 0)]
+        while stack:
+            node, path, depth = stack.pop()
+            if node.files is None:
+                # Could not be listed, a fresh scan would skip it as well
+                continue
+            dirs = [walker.Entry(path, name, is_dir=True) for name in node.dirs]
+            files = [walker.Entry(path, name) for name in node.files]
+            yield path, depth, dirs, files
+            for child in reversed(list(node.dirs.values())):
+                stack.append((child, os.path.join(path, child.name), depth + 1))
+
+    def read_events(self, timeout=None):
+        """Wait up to timeout seconds for events and apply them; returns how many changed the tree"""
+        ready, _, _ = select.select([self._inotify.fd], [], [], timeout)
+        if not ready:
+            return 0
+        changes = 0
+        for wd, mask, cookie, name in self._inotify.read_events():
+            if self._apply(wd, mask, name):
+                changes += 1
+        return changes
+
+    def run(self, on_change, debounce=1.0, max_delay=None):
+        """Call on_change(self) after each burst of changes, until interrupted
+
+        A burst ends once no event arrived for debounce seconds, or after
+        max_delay seconds (default 10 * debounce) on a tree that never
+        settles.
+        """
+        if max_delay is None:
+            max_delay = 10 * debounce
+        pending_since = last_change = None
+        while True:
+            timeout = None
+            if pending_since is not None:
+                now = time.monotonic()
+                deadline = min(last_change + debounce, pending_since + max_delay)
+                if now >= deadline:
+                    on_change(self)
+                    pending_since = None
+                    continue
+                timeout = deadline - now
+            if self.read_events(timeout):
+                last_change = time.monotonic()
+                if pending_since is None:
+                    pending_since = last_change
+
+    def memory_report(self):
+        """Return a one-line summary of watches, limits and memory use"""
+        nodes = list(self._nodes.values())
+        model_bytes = sum(
+            sys.getsizeof(node) + sys.getsizeof(node.dirs) + sys.getsizeof(node.files)
+            + sys.getsizeof(node.name) + sum(sys.getsizeof(name) for name in node.files or ())
+            for node in nodes
+        )
+        per_directory = model_bytes // len(nodes) if nodes else 0
+        limit = f"{self.watch_limit:,}" if self.watch_limit is not None else "unknown"
+        report = (f"Watching {self.watches:,} directories (limit {limit}), "
+                  f"~{self.watches * KERNEL_BYTES_PER_WATCH / 2**20:.1f} MiB kernel memory, "
+                  f"~{model_bytes / 2**20:.1f} MiB tree model ({per_directory:,} bytes per directory)")
+        if self.unwatched:
+            report += (f"\nWarning: {self.unwatched:,} directories are not watched and will not update; "
+                       f"raise fs.inotify.max_user_watches (sysctl) to watch them")
+        return report
+
+    def close(self):
+        self._inotify.close()
+
+    def _scan_into(self, node):
+        # Walks the subtree of node, watching each directory before it is
+        # listed so that entries created meanwhile are reported as events
+        nodes = {node.path(): node}
+        scan = self._watched_scan(nodes)
+        for path, depth, dirs, files in walker.walk(node.path(), scan=scan):
+            current = nodes.pop(path)
+            current.files = {entry.name: None for entry in files
+                             if os.path.abspath(entry.path) not in self.ignore}
+            for entry in walker.subdirectories(dirs):
+                child = _DirNode(entry.name, current)
+                current.dirs[entry.name] = child
+                nodes[entry.path] = child
+
+    def _watched_scan(self, nodes):
+        def scan(path):
+            node = nodes[path]
+            try:
+                node.wd = self._inotify.add_watch(path)
+                self._nodes[node.wd] = node
+            except OSError as e:
+                if e.errno not in (errno.ENOSPC, errno.EACCES, errno.ENOENT):
+                    raise
+                self.unwatched += 1
+            return walker.scan_directory(path)
+        return scan
+
+    def _forget(self, node):
+        # Drops the watches of a removed or moved-away subtree
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current.wd is not None and self._nodes.pop(current.wd, None) is current:
+                self._inotify.rm_watch(current.wd)
+            self._dirty.pop(id(current), None)
+            stack.extend(current.dirs.values())
+
+    def _apply(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            # Events were lost, only a full rescan is reliable
+            self.scan()
+            return True
+        if mask & IN_IGNORED:
+            self._nodes.pop(wd, None)
+            return False
+
+        node = self._nodes.get(wd)
+        if node is None or not name:
+            return False
+        if os.path.abspath(os.path.join(node.path(), name)) in self.ignore:
+            return False
+        if mask & (IN_DELETE | IN_MOVED_FROM) and name in node.dirs:
+            # Release the watches of the removed subtree right away
+            self._forget(node.dirs.pop(name))
+        self._dirty[id(node)] = node
+        return True
+
+    def _refresh(self):
+        # Entry order is defined by the filesystem, so changed directories
+        # are listed again instead of patching the model from event names.
+        # New subdirectories are scanned, vanished ones dropped.
+        while self._dirty:
+            node = self._dirty.popitem()[1]
+            try:
+                dirs, files = walker.scan_directory(node.path())
+            except OSError:
+                continue
+            node.files = {entry.name: None for entry in files
+                          if os.path.abspath(entry.path) not in self.ignore}
+            old_dirs = node.dirs
+            node.dirs = {}
+            for entry in walker.subdirectories(dirs):
+                child = old_dirs.pop(entry.name, None)
+                node.dirs[entry.name] = child or _DirNode(entry.name, node)
+                if child is None:
+                    self._scan_into(node.dirs[entry.name])
+            for child in old_dirs.values():
+                self._forget(child)